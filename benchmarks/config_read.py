@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2015 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares Config._read_file() with the RawConfigParser based reader
+# on a synthetic set of drop-in files.
+#
+#   python3 benchmarks/config_read.py [--files 500] [--repeat 5]
+
+import argparse
+import configparser
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lightdm_gtk_greeter_settings import Config  # noqa: E402
+
+
+BaseName = 'benchmark-greeter.conf'
+
+
+def generate(path, count):
+    drop_ins = os.path.join(path, 'lightdm', BaseName + '.d')
+    os.makedirs(drop_ins)
+    for i in range(count):
+        with open(os.path.join(drop_ins, '%04d.conf' % i), 'w') as f:
+            f.write('# Generated file %d\n[greeter]\n' % i)
+            f.write('theme-name = Theme-%d\nicon-theme-name = Icons-%d\n' % (i, i))
+            f.write('font-name = Sans %d\nbackground = /usr/share/backgrounds/%d.png\n' % (i, i))
+            f.write('indicators = ~host;~spacer;~clock;~spacer;~language;~session;~power\n')
+            f.write('-xft-dpi =\nclock-format = %%a, %%H:%%M\n')
+            f.write('\n[monitor: HDMI-%d]\nbackground = #%06x\nlaptop = %s\n' %
+                    (i, i, 'true' if i % 2 else 'false'))
+    return sorted(os.path.join(drop_ins, name) for name in os.listdir(drop_ins))
+
+
+def read_file_configparser(path):
+    config_file = configparser.RawConfigParser(strict=False, allow_no_value=True)
+    if not config_file.read(path):
+        return None
+    sections = []
+    for groupname, values in config_file.items():
+        if groupname == 'DEFAULT':
+            continue
+        items = []
+        for key, value in values.items():
+            if value is None:
+                continue
+            if key.startswith('-'):
+                key = key[1:]
+                value = None
+            items.append((key, value))
+        sections.append((groupname, tuple(items)))
+    return tuple(sections)
+
+
+def measure(title, func, files, repeat):
+    best = None
+    for __ in range(repeat):
+        start = time.perf_counter()
+        for path in files:
+            func(path)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{title:<24} {time:8.2f} ms'.format(title=title, time=best * 1000))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Config reader benchmark')
+    parser.add_argument('--files', type=int, default=500)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        files = generate(path, args.files)
+        config = Config.Config(base_name=BaseName)
+        config._output_path = os.path.join(path, 'lightdm', BaseName)
+
+        print('{count} files'.format(count=len(files)))
+        old = measure('RawConfigParser', read_file_configparser, files, args.repeat)
+        new = measure('Config._read_file', config._read_file, files, args.repeat)
+        print('Speedup: {ratio:.2f}x'.format(ratio=old / new))
+
+        def read_all(path):
+            config._files_cache.clear()
+            config.read()
+
+        def read_cached(path):
+            config.read()
+
+        measure('Config.read (cold)', read_all, (None,), args.repeat)
+        measure('Config.read (cached)', read_cached, (None,), args.repeat)
+
+
+if __name__ == '__main__':
+    main()
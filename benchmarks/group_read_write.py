@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2015 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Times SimpleGroup.read() and write() over all greeter options with and
+# without emission of "get"/"set" signals for entries without handlers.
+# Entries keep values in memory, so only the entry/group machinery is measured,
+# both variants use the same BaseEntry.value accessors.
+#
+#   python3 benchmarks/group_read_write.py [--repeat 200]
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gi.repository import Gtk  # noqa: E402
+
+from lightdm_gtk_greeter_settings import Config  # noqa: E402
+from lightdm_gtk_greeter_settings.GreeterDefaults import GreeterDefaults  # noqa: E402
+from lightdm_gtk_greeter_settings.OptionEntry import BaseEntry  # noqa: E402
+from lightdm_gtk_greeter_settings.OptionGroup import SimpleGroup  # noqa: E402
+
+
+BaseName = 'benchmark-greeter.conf'
+
+
+class MemoryEntry(BaseEntry):
+
+    def __init__(self, widgets):
+        super().__init__(widgets)
+        self._value = None
+
+    def _get_value(self):
+        return self._value
+
+    def _set_value(self, value):
+        if value != self._value:
+            self._value = value
+            self._emit_changed()
+
+
+class EmittingEntry(MemoryEntry):
+    '''Previous behaviour: signals are emitted for every access'''
+
+    def __init__(self, widgets):
+        super().__init__(widgets)
+        # Handlers are not connected, but emission is not skipped
+        self._BaseEntry__connected_signals = frozenset(('get', 'set'))
+
+
+def create_group(klass):
+    options = {key: (klass, default) for key, default in GreeterDefaults.items()}
+    group = SimpleGroup('greeter', Gtk.Builder(), options)
+    return group
+
+
+def measure(title, func, repeat):
+    best = None
+    for __ in range(5):
+        start = time.perf_counter()
+        for __ in range(repeat):
+            func()
+        elapsed = (time.perf_counter() - start) / repeat
+        best = elapsed if best is None else min(best, elapsed)
+    print('{title:<32} {time:8.3f} ms'.format(title=title, time=best * 1000))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='SimpleGroup read/write benchmark')
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as path:
+        config = Config.Config(base_name=BaseName)
+        config._output_path = os.path.join(path, 'lightdm', BaseName)
+        config.read()
+        for key, default in GreeterDefaults.items():
+            config['greeter', key] = default if default is not None else 'value'
+
+        print('{count} entries'.format(count=len(GreeterDefaults)))
+        results = {}
+        for title, klass in (('emit always', EmittingEntry), ('emit if connected', MemoryEntry)):
+            group = create_group(klass)
+            group.read(config)
+            read = measure('read, ' + title, lambda: group.read(config), args.repeat)
+            write = measure('write, ' + title, lambda: group.write(config), args.repeat)
+            results[title] = read, write
+
+        (old_read, old_write), (new_read, new_write) = results.values()
+        print('Speedup: read {read:.2f}x, write {write:.2f}x'.format(read=old_read / new_read,
+                                                                     write=old_write / new_write))
+
+
+if __name__ == '__main__':
+    main()
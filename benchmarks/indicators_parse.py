@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2015 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Compares IndicatorsEntry._read_options_string() with the previous
+# character-by-character tokenizer on generated "indicators" values.
+#
+#   python3 benchmarks/indicators_parse.py [--indicators 1000] [--repeat 5]
+
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lightdm_gtk_greeter_settings.IndicatorsEntry import (  # noqa: E402
+    IndicatorsEntry,
+    Option)
+
+
+class Tokenizer:
+    '''IndicatorsEntry tokenizer methods without widgets'''
+    _read_options_string = IndicatorsEntry._read_options_string
+    _next_string_token = IndicatorsEntry._next_string_token
+
+
+def read_options_string_old(s):
+    while s:
+        name, s = next_string_token_old(s, ':;')
+        options = {Option.Name: name}
+
+        if s.startswith(':'):
+            while s:
+                option, s = next_string_token_old(s[1:], '=,;')
+                if s.startswith('='):
+                    value, s = next_string_token_old(s[1:], ',;')
+                else:
+                    value = None
+                options[option] = value
+                if not s.startswith(','):
+                    break
+
+        yield options
+        s = s[1:]
+
+
+def next_string_token_old(s, delimiters):
+    token = []
+    quoted = False
+
+    for last, c in enumerate(s):
+        if not c.isspace():
+            break
+
+    for i, c in enumerate(s[last:], last):
+        if c == '"':
+            if i > last and s[i - 1] == '\\':
+                token.append(s[last:i - 1])
+                token.append('"')
+            else:
+                token.append(s[last:i])
+                quoted = not quoted
+            last = i + 1
+        elif not quoted and c in delimiters:
+            break
+
+    if quoted:
+        return '', ''
+
+    if last != i or last == 0:
+        token.append(s[last: i if c in delimiters else i + 1].rstrip())
+
+    return ''.join(token) if token else None, s[i:]
+
+
+def generate(count):
+    items = []
+    for i in range(count):
+        kind = i % 4
+        if kind == 0:
+            items.append('~text:text="Message \\"%d\\", see ; and :",markup' % i)
+        elif kind == 1:
+            items.append('/usr/lib/indicators3/7/libindicator-%d.so' % i)
+        elif kind == 2:
+            items.append('~~Label %d' % i)
+        else:
+            items.append('~clock:expand,align=right,fallback=time-%d' % i)
+    return ';'.join(items)
+
+
+def measure(title, func, value, repeat):
+    best = None
+    for __ in range(repeat):
+        start = time.perf_counter()
+        list(func(value))
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    print('{title:<24} {time:8.2f} ms'.format(title=title, time=best * 1000))
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Indicators tokenizer benchmark')
+    parser.add_argument('--indicators', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    entry = Tokenizer()
+    value = generate(args.indicators)
+    assert list(entry._read_options_string(value)) == list(read_options_string_old(value))
+
+    print('{count} indicators, {length} characters'.format(count=args.indicators,
+                                                           length=len(value)))
+    old = measure('Previous tokenizer', read_options_string_old, value, args.repeat)
+    new = measure('_read_options_string', entry._read_options_string, value, args.repeat)
+    print('Speedup: {ratio:.2f}x'.format(ratio=old / new))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2014 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Command line mode: --get, --set, --unset and --apply work with Config directly,
+# Gtk is not imported and display is not required.
+# Config (and gi with it) is imported only when command line mode is requested.
+
+import configparser
+import sys
+
+from lightdm_gtk_greeter_settings.GreeterDefaults import GreeterDefaults
+
+
+__all__ = ['add_arguments', 'is_requested', 'run']
+
+
+class CommandLineError(Exception):
+    pass
+
+
+def add_arguments(parser):
+    group = parser.add_argument_group('command line mode')
+    group.add_argument('--get', action='append', metavar='GROUP.KEY', default=[],
+                       help='Print value of option, default value is used if option '
+                            'is not defined')
+    group.add_argument('--set', action='append', nargs='+', metavar='GROUP.KEY=VALUE',
+                       default=[], help='Change value of option')
+    group.add_argument('--unset', action='append', metavar='GROUP.KEY', default=[],
+                       help='Remove option')
+    group.add_argument('--apply', action='append', metavar='FILE', default=[],
+                       help='Change values of all options defined in INI file, '
+                            '"-key" removes option')
+    group.add_argument('--show-origin', action='store_true',
+                       help='Print "FILE:LINE" (or "default") before values printed by --get')
+
+
+def is_requested(args):
+    return bool(args.get or args.set or args.unset or args.apply)
+
+
+def run(args):
+    '''Applies all changes with single read-write cycle, then prints requested values.
+       Returns exit status.'''
+    from lightdm_gtk_greeter_settings.Config import Config
+
+    try:
+        changes = []
+        for path in args.apply:
+            changes += _read_profile(path)
+        for arg in (arg for args_list in args.set for arg in args_list):
+            changes.append(_parse_assignment(arg))
+        for arg in args.unset:
+            changes.append(_parse_key(arg) + (None,))
+        requested = [_parse_key(arg) for arg in args.get]
+    except CommandLineError as e:
+        print(e, file=sys.stderr)
+        return 2
+
+    config = Config()
+    config.read()
+
+    if changes:
+        for group, key, value in changes:
+            default = GreeterDefaults.get(key) if group == 'greeter' else None
+            if group == 'greeter' and key not in GreeterDefaults:
+                print('Unknown option: {group}.{key}'.format(group=group, key=key),
+                      file=sys.stderr)
+            config[group, key] = value, default
+        try:
+            config.write()
+        except OSError as e:
+            print(e, file=sys.stderr)
+            return 1
+
+    status = 0
+    for group, key in requested:
+        effective = config.effective.get((group, key))
+        value = effective.value if effective else None
+        origin = _format_origin(effective)
+        if value is None and group == 'greeter':
+            value = GreeterDefaults.get(key)
+            origin = 'default'
+        if value is None:
+            status = 1
+            value = ''
+        if args.show_origin:
+            print('{origin}\t{value}'.format(origin=origin, value=value))
+        else:
+            print(value)
+    return status
+
+
+def _format_origin(effective):
+    if effective is None:
+        return ''
+    if effective.line is None:
+        return effective.path
+    return '{path}:{line}'.format(path=effective.path, line=effective.line)
+
+
+def _parse_key(arg):
+    '''"group.key" => (group, key), the last dot separates key'''
+    group, dot, key = arg.rpartition('.')
+    if not dot or not group or not key:
+        raise CommandLineError('Invalid option name, "GROUP.KEY" expected: {arg}'
+                               .format(arg=arg))
+    return group, key.strip().lower()
+
+
+def _parse_assignment(arg):
+    '''"group.key=value" => (group, key, value)'''
+    name, eq, value = arg.partition('=')
+    if not eq:
+        raise CommandLineError('Invalid assignment, "GROUP.KEY=VALUE" expected: {arg}'
+                               .format(arg=arg))
+    return _parse_key(name) + (value.strip(),)
+
+
+def _read_profile(path):
+    '''Returns [(group, key, value), ...] for all options of INI file'''
+    from lightdm_gtk_greeter_settings.Config import scan_config_lines
+
+    try:
+        with open(path) as file:
+            lines = file.readlines()
+        tokens = list(scan_config_lines(lines, path))
+    except (OSError, UnicodeDecodeError, configparser.Error) as e:
+        raise CommandLineError(e)
+
+    changes = []
+    for __, __, group, key, value in tokens:
+        if key is None or group == 'DEFAULT':
+            continue
+        if key.startswith('-'):
+            changes.append((group, key[1:], None))
+        elif value is not None:
+            changes.append((group, key, value))
+        else:
+            raise CommandLineError('{path}: [{group}] {key}: Keys without values are not allowed'
+                                   .format(path=path, group=group, key=key))
+    return changes
@@ -16,22 +16,101 @@
 #   with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 import configparser
+import fcntl
 import os
+import re
+import stat
 import sys
-from collections import OrderedDict
+import tempfile
+from collections import (
+    namedtuple,
+    OrderedDict)
+from contextlib import contextmanager
 from glob import iglob
+from types import MappingProxyType
 
-from gi.repository import GLib
+from gi.repository import (
+    Gio,
+    GLib)
 
 from lightdm_gtk_greeter_settings import helpers
 
 
+SectionRegex = re.compile(r'\[(?P<header>.+)\]')
+OptionRegex = re.compile(r'(?P<option>.*?)\s*(?:(?P<delimiter>[=:])\s*(?P<value>.*))?$')
+
+# Final value of option: value is None if option is removed by "-key" line,
+# line is None for values not read from file, shadowed: ((path, value), ...) from
+# lower priority files
+EffectiveValue = namedtuple('EffectiveValue', ('value', 'path', 'line', 'shadowed'))
+
+
+def scan_config_lines(lines, source='<???>', strict=True):
+    '''Yields (first_line, last_line, section, key, value) for every option of INI file.
+       Section headers are reported with key = None, value is None for keys without values.
+       Follows RawConfigParser(strict=False, allow_no_value=True) syntax.
+       Invalid lines raise configparser errors in strict mode and are skipped otherwise.'''
+    error = None
+    section = None
+    # [first_line, last_line, key, [value lines]]
+    option = None
+    indent_level = 0
+
+    for lineno, line in enumerate(lines, 1):
+        value = line.strip()
+        if not value:
+            if option and option[3] is not None:
+                option[3].append('')
+            continue
+        if value[0] in '#;':
+            continue
+
+        cur_indent_level = len(line) - len(line.lstrip())
+        if option and cur_indent_level > indent_level and option[3] is not None:
+            option[3].append(value)
+            option[1] = lineno
+            continue
+
+        if option:
+            first, last, key, values = option
+            yield (first, last, section, key,
+                   '\n'.join(values).rstrip() if values is not None else None)
+            option = None
+
+        indent_level = cur_indent_level
+        match = SectionRegex.match(value)
+        if match:
+            section = match.group('header')
+            yield lineno, lineno, section, None, None
+        elif section is None:
+            if strict:
+                raise configparser.MissingSectionHeaderError(source, lineno, line)
+        else:
+            match = OptionRegex.match(value)
+            key = match.group('option')
+            if key:
+                option = [lineno, lineno, key.rstrip().lower(),
+                          [match.group('value').strip()] if match.group('delimiter') else None]
+            elif strict:
+                error = error or configparser.ParsingError(source)
+                error.append(lineno, line)
+
+    if option:
+        first, last, key, values = option
+        yield (first, last, section, key,
+               '\n'.join(values).rstrip() if values is not None else None)
+
+    if error:
+        raise error
+
+
 class Config:
 
     class ConfigGroup:
 
-        def __init__(self, config):
+        def __init__(self, config, name=None):
             self._config = config
+            self._name = name
             self._items = OrderedDict()
 
         def __iter__(self):
@@ -55,6 +134,8 @@ class Config:
             if values and values[-1][1] == value:
                 return
 
+            self._config._changed_groups.add(self._name)
+            self._config._changed_keys.add((self._name, item))
             if values and values[-1][0] == self._config._output_path:
                 if len(values) > 1 and values[-2][1] == value:
                     del values[-1]
@@ -69,88 +150,516 @@ class Config:
                 if default is None or value != default:
                     self._items[item] = [(self._config._output_path, value)]
 
+            self._config._update_effective(self._name, item)
+
         def __delitem__(self, item):
             values = self._items.get(item)
             if values is not None:
                 if values and values[-1][0] == self._config._output_path:
+                    self._config._changed_groups.add(self._name)
+                    self._config._changed_keys.add((self._name, item))
                     del values[-1]
                 if not values:
                     del self._items[item]
+                self._config._update_effective(self._name, item)
 
     def __init__(self, base_dir='lightdm', base_name='lightdm-gtk-greeter.conf'):
         self._base_dir = base_dir
         self._base_name = base_name
         self._output_path = helpers.get_config_path()
         self._groups = OrderedDict()
+        # Configuration files in order of priority, found by last read() or refresh()
+        self._files = []
+        # path => ((mtime, size, inode), parsed content, {(group, key): [(value, line), ...]})
+        self._files_cache = {}
+        # (path, group, key) => line number
+        self._lines = {}
+        # Groups changed since last read() or write()
+        self._changed_groups = set()
+        # (group, key) changed since last read() or write()
+        self._changed_keys = set()
+        # Directory path => Gio.FileMonitor
+        self._monitors = {}
+        self._monitor_callback = None
+        self._refresh_scheduler = None
         self._key_values = helpers.SimpleDictWrapper(getter=self._get_key_values)
+        # (group, key) => EffectiveValue
+        self._effective = {}
+        self._effective_view = MappingProxyType(self._effective)
 
     def read(self):
         self._groups.clear()
+        self._lines.clear()
+        self._changed_groups.clear()
+        self._changed_keys.clear()
+        self._effective.clear()
 
-        pathes = []
-        pathes += GLib.get_system_data_dirs()
-        pathes += GLib.get_system_config_dirs()
-        pathes.append(os.path.dirname(os.path.dirname(self._output_path)))
-
-        files = []
-        for path in pathes:
-            files += sorted(iglob(os.path.join(path, self._base_dir,
-                                               self._base_name + '.d', '*.conf')))
-            files.append(os.path.join(path, self._base_dir, self._base_name))
+        self._files = self._get_files()
+        self._files_cache = self._read_files(self._files)
 
-        for path in filter(os.path.isfile, files):
-            config_file = configparser.RawConfigParser(strict=False, allow_no_value=True)
-            try:
-                if not config_file.read(path):
-                    continue
-            except configparser.Error as e:
-                print(e, file=sys.stderr)
+        for path in self._files:
+            cached = self._files_cache.get(path)
+            if cached is None:
                 continue
 
-            for groupname, values in config_file.items():
-                if groupname == 'DEFAULT':
-                    continue
-
+            for groupname, items in cached[1]:
                 if groupname not in self._groups:
-                    self._groups[groupname] = Config.ConfigGroup(self)
+                    self._groups[groupname] = Config.ConfigGroup(self, groupname)
                 group = self._groups[groupname]
 
-                for key, value in values.items():
-                    if value is None:
-                        print('[{group}] {key}: Keys without values are not allowed'.format(
-                            group=groupname, key=key), file=sys.stderr)
-                        continue
-                    if key.startswith('-'):
-                        key = key[1:]
-                        value = None
-
+                for key, value, line in items:
                     if key in group._items:
                         values = group._items[key]
                         if value is not None or values:
                             values.append((path, value))
+                            self._lines[path, groupname, key] = line
                     elif value is not None:
                         group._items[key] = [(path, value)]
+                        self._lines[path, groupname, key] = line
 
-    def write(self):
-        config_file = configparser.RawConfigParser(strict=False)
+        for groupname, group in self._groups.items():
+            for key in group._items:
+                self._update_effective(groupname, key)
+
+    def refresh(self):
+        '''Parses files changed since last read() or refresh() and merges their options into
+           values stacks. Options changed in memory and not written yet keep their values.
+           Returns (changed, conflicts): sets of (group, key) which effective value is changed
+           and of options changed both in memory and in files.'''
+        old_files, old_cache = self._files, self._files_cache
+        self._files = self._get_files()
+        self._files_cache = self._read_files(self._files)
+
+        affected = set()
+        files_changed = False
+        for path in set(old_cache) | set(self._files_cache):
+            old = old_cache.get(path)
+            new = self._files_cache.get(path)
+            if old is not new:
+                files_changed = True
+                affected.update(old[2] if old else ())
+                affected.update(new[2] if new else ())
+
+        changed = set()
+        conflicts = set()
+        for groupname, key in affected:
+            old_stack = self._get_files_stack(old_files, old_cache, groupname, key)
+            new_stack = self._get_files_stack(self._files, self._files_cache, groupname, key)
+            if old_stack == new_stack:
+                continue
+
+            for path, __, line in new_stack:
+                self._lines[path, groupname, key] = line
+            values = [(path, value) for path, value, __ in new_stack]
+
+            group = self._groups.get(groupname)
+            if (groupname, key) in self._changed_keys:
+                conflicts.add((groupname, key))
+                current = group._items.get(key) if group else None
+                values = [item for item in values if item[0] != self._output_path]
+                if current and current[-1][0] == self._output_path:
+                    values.append(current[-1])
+
+            before = self._effective.get((groupname, key))
+            if values:
+                self.add_group(groupname)._items[key] = values
+            elif group:
+                group._items.pop(key, None)
+            self._update_effective(groupname, key)
+            after = self._effective.get((groupname, key))
+
+            if (before and before.value) != (after and after.value):
+                changed.add((groupname, key))
+
+        if files_changed:
+            # Sections without options are groups too
+            sections = {groupname for cached in self._files_cache.values()
+                        for groupname, __ in cached[1]}
+            for groupname in sections:
+                self.add_group(groupname)
+            for groupname in [name for name, group in self._groups.items()
+                              if not group._items and name not in sections and
+                              name not in self._changed_groups]:
+                del self._groups[groupname]
+
+        return changed, conflicts
+
+    def monitor(self, callback):
+        '''Watches directories scanned by read(), refresh() is called after changes.
+           callback(changed, conflicts) is called in main loop if something is changed.'''
+        self._monitor_callback = callback
+        if self._refresh_scheduler is None:
+            self._refresh_scheduler = helpers.WriteScheduler(self._on_refresh_timeout,
+                                                             delay=500, max_latency=3000)
+        for path in self._get_directories():
+            if path in self._monitors:
+                continue
+            try:
+                monitor = Gio.File.new_for_path(path).monitor_directory(
+                    Gio.FileMonitorFlags.NONE, None)
+            except GLib.Error:
+                continue
+            monitor.connect('changed', self._on_directory_changed)
+            self._monitors[path] = monitor
 
+    def _get_files(self):
+        '''Returns list of configuration files in order of priority (lowest first)'''
+        files = []
+        for path in self._get_base_pathes():
+            files += sorted(iglob(os.path.join(path, self._base_dir,
+                                               self._base_name + '.d', '*.conf')))
+            files.append(os.path.join(path, self._base_dir, self._base_name))
+        return files
+
+    def _get_directories(self):
+        '''Returns directories where configuration files can be found'''
+        directories = []
+        for path in self._get_base_pathes():
+            directory = os.path.join(path, self._base_dir)
+            directories += (directory, os.path.join(directory, self._base_name + '.d'))
+        return directories
+
+    def _get_base_pathes(self):
+        pathes = []
+        pathes += GLib.get_system_data_dirs()
+        pathes += GLib.get_system_config_dirs()
+        pathes.append(os.path.dirname(os.path.dirname(self._output_path)))
+        return pathes
+
+    def _read_files(self, files):
+        '''Returns {path: (file key, sections, {(group, key): [(value, line), ...]})}'''
+        files_cache = {}
+        for path in files:
+            if path in files_cache:
+                continue
+            file_key = self._get_file_key(path)
+            if file_key is None:
+                continue
+
+            # Files are parsed again only if they were changed since the last call
+            cached = self._files_cache.get(path)
+            if cached and cached[0] == file_key:
+                files_cache[path] = cached
+                continue
+
+            sections = self._read_file(path)
+            if sections is not None:
+                files_cache[path] = self._new_cache_item(file_key, sections)
+        return files_cache
+
+    @staticmethod
+    def _get_file_key(path):
+        '''Returns (mtime, size, inode) of regular file or None'''
+        try:
+            st = os.stat(path)
+        except OSError:
+            return None
+        if not stat.S_ISREG(st.st_mode):
+            return None
+        return st.st_mtime_ns, st.st_size, st.st_ino
+
+    @staticmethod
+    def _new_cache_item(file_key, sections):
+        # Section can have both "key" and "-key", all of them are stacked by read()
+        options = {}
+        for groupname, items in sections:
+            for key, value, line in items:
+                options.setdefault((groupname, key), []).append((value, line))
+        return file_key, sections, options
+
+    @staticmethod
+    def _get_files_stack(files, files_cache, groupname, key):
+        '''Returns [(path, value, line), ...] for option, the same way read() merges files'''
+        stack = []
+        for path in files:
+            cached = files_cache.get(path)
+            for value, line in cached[2].get((groupname, key), ()) if cached else ():
+                if value is not None or stack:
+                    stack.append((path, value, line))
+        return stack
+
+    def _on_directory_changed(self, monitor, file, other_file, event_type):
+        for changed in (file, other_file):
+            path = changed.get_path() if changed else None
+            if not path:
+                continue
+            dirname, basename = os.path.split(path)
+            if basename == self._base_name or basename == self._base_name + '.d' or \
+               (basename.endswith('.conf') and not basename.startswith('.') and
+                    os.path.basename(dirname) == self._base_name + '.d'):
+                self._refresh_scheduler.schedule()
+                return
+
+    def _on_refresh_timeout(self):
+        changed, conflicts = self.refresh()
+        if (changed or conflicts) and self._monitor_callback:
+            self._monitor_callback(changed, conflicts)
+
+    def _read_file(self, path):
+        '''Returns ((group, ((key, value, line), ...)), ...) or None if file can't be read'''
+        try:
+            with open(path) as file:
+                lines = file.readlines()
+        except (OSError, UnicodeDecodeError):
+            return None
+        return self._parse_lines(lines, path)
+
+    @staticmethod
+    def _parse_lines(lines, path):
+        '''See _read_file()'''
+        # The same section can be defined multiple times, the last value of option wins
+        sections = OrderedDict()
+        # Options of [DEFAULT] section are inherited by all sections of file,
+        # as RawConfigParser does
+        defaults = OrderedDict()
+        try:
+            for first, __, groupname, key, value in scan_config_lines(lines, path):
+                if groupname == 'DEFAULT':
+                    items = defaults
+                else:
+                    items = sections.get(groupname)
+                    if items is None:
+                        items = sections[groupname] = OrderedDict()
+                if key is None:
+                    continue
+                # Key without value replaces previous value and is skipped below,
+                # as RawConfigParser did
+                items[key] = value, first
+        except configparser.Error as e:
+            print(e, file=sys.stderr)
+            return None
+
+        for groupname, items in sections.items():
+            for key, option in defaults.items():
+                items.setdefault(key, option)
+            for key, (value, __) in items.items():
+                if value is None:
+                    print('[{group}] {key}: Keys without values are not allowed'.format(
+                        group=groupname, key=key), file=sys.stderr)
+
+        return tuple((groupname, tuple((key[1:], None, line) if key.startswith('-')
+                                       else (key, value, line)
+                                       for key, (value, line) in items.items()
+                                       if value is not None))
+                     for groupname, items in sections.items())
+
+    def write(self, groups=None):
+        '''Writes groups to output file, all groups are written if "groups" is None.
+           If file is changed by other program since it was read, its values are merged
+           first (see refresh()), so only options changed here are overwritten.'''
+        if groups is not None:
+            groups = set(groups)
+            if not groups:
+                return
+
+        path = os.path.realpath(self._output_path)
+        changed = None
+        # Lock is held only while file is checked and replaced
+        with self._lock_directory(os.path.dirname(path)):
+            cached = self._files_cache.get(self._output_path)
+            if self._output_path in self._files and \
+               self._get_file_key(path) != (cached[0] if cached else None):
+                changed, __ = self.refresh()
+
+            try:
+                with open(path) as file:
+                    text = file.read()
+            except FileNotFoundError:
+                text = ''
+
+            new_text = ''.join(self._patch_lines(text.splitlines(True),
+                                                 self._get_output_sections(groups), groups))
+            if new_text != text:
+                self._write_file(path, new_text)
+                self._update_output_cache(path, new_text)
+
+        if groups is None:
+            self._changed_groups.clear()
+            self._changed_keys.clear()
+        else:
+            self._changed_groups -= groups
+            self._changed_keys = {(group, key) for group, key in self._changed_keys
+                                  if group not in groups}
+
+        if changed and self._monitor_callback:
+            self._monitor_callback(changed, set())
+
+    def _get_output_sections(self, groups=None):
+        '''Returns {group: {key: value}} for options defined in output file'''
+        sections = OrderedDict()
         for groupname, group in self._groups.items():
-            config_section = None
+            if groups is not None and groupname not in groups:
+                continue
+            items = sections[groupname] = OrderedDict()
             for key, values in group._items.items():
                 if not values or values[-1][0] != self._output_path:
                     continue
 
                 if values[-1][1] is not None or len(values) > 1:
-                    if not config_section:
-                        config_file.add_section(groupname)
-                        config_section = config_file[groupname]
                     if values[-1][1] is None:
-                        config_section['-' + key] = ''
+                        items['-' + key] = ''
                     else:
-                        config_section[key] = values[-1][1]
+                        items[key] = values[-1][1]
+        return sections
+
+    def _update_output_cache(self, path, text):
+        '''Output file is written: its content matches values stacks, so next refresh()
+           must not parse it again'''
+        if self._output_path not in self._files:
+            return
+        file_key = self._get_file_key(path)
+        sections = self._parse_lines(text.splitlines(True), path) if file_key else None
+        if sections is None:
+            self._files_cache.pop(self._output_path, None)
+            return
 
-        with open(self._output_path, 'w') as file:
-            config_file.write(file)
+        cached = self._files_cache[self._output_path] = self._new_cache_item(file_key, sections)
+        for (groupname, key), options in cached[2].items():
+            self._lines[self._output_path, groupname, key] = options[-1][1]
+            self._update_effective(groupname, key)
+
+    @staticmethod
+    @contextmanager
+    def _lock_directory(path):
+        '''Exclusive advisory lock of directory, files in it are replaced by rename()'''
+        try:
+            fd = os.open(path, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            yield
+            return
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            yield
+        finally:
+            os.close(fd)
+
+    @property
+    def changed_groups(self):
+        '''Names of groups changed since last read() or write()'''
+        return frozenset(self._changed_groups)
+
+    def _patch_lines(self, lines, sections, groups=None):
+        '''Returns lines of file with options replaced by values from "sections".
+           Comments, order of options and unknown sections are preserved.
+           Only sections listed in "groups" are changed if it is not None.'''
+        # line index => replacement lines, [] to remove line
+        patches = {}
+        # section => index of line to insert new options after
+        insert_after = {}
+        sections_options = {}
+        last_options = {}
+
+        tokens = list(scan_config_lines(lines, strict=False))
+        for first, last, section, key, value in tokens:
+            if key is None:
+                insert_after[section] = first - 1
+                sections_options.setdefault(section, [])
+            else:
+                insert_after[section] = last - 1
+                sections_options[section].append((first, last))
+                last_options[section, key] = first
+
+        kept_options = {section: 0 for section in sections_options}
+        for first, last, section, key, value in tokens:
+            if key is None:
+                continue
+            if section == 'DEFAULT' or (groups is not None and section not in groups):
+                kept_options[section] += 1
+                continue
+            items = sections.get(section, {})
+            if key not in items:
+                for i in range(first - 1, last):
+                    patches[i] = []
+                continue
+            kept_options[section] += 1
+            if last_options[section, key] == first and value != items[key]:
+                patches[first - 1] = [self._format_option(key, items[key])]
+                for i in range(first, last):
+                    patches[i] = []
+
+        new_sections = []
+        for section, items in sections.items():
+            new_items = [self._format_option(key, value) for key, value in items.items()
+                         if (section, key) not in last_options]
+            if section in insert_after:
+                if new_items:
+                    kept_options[section] += len(new_items)
+                    idx = insert_after[section]
+                    line = lines[idx] if lines[idx].endswith('\n') else lines[idx] + '\n'
+                    patches.setdefault(idx, [line]).extend(new_items)
+            elif new_items:
+                if new_sections:
+                    new_sections.append('\n')
+                new_sections.append('[{section}]\n'.format(section=section))
+                new_sections += new_items
+
+        # Removing headers of sections which have no options anymore
+        for first, last, section, key, value in tokens:
+            if key is None and sections_options[section] and not kept_options[section]:
+                patches[first - 1] = []
+
+        result = []
+        for i, line in enumerate(lines):
+            patch = patches.get(i)
+            if patch is None:
+                result.append(line)
+            else:
+                result += patch
+        if new_sections:
+            if result and not result[-1].endswith('\n'):
+                result[-1] += '\n'
+            if result and result[-1].strip():
+                result.append('\n')
+            result += new_sections
+        return result
+
+    @staticmethod
+    def _format_option(key, value):
+        return '{key} = {value}\n'.format(key=key, value=value.replace('\n', '\n\t'))
+
+    @staticmethod
+    def _write_file(path, text):
+        '''Writes file atomically: temporary file in the same directory is renamed to "path"'''
+        dirname, basename = os.path.split(path)
+        try:
+            fd, tmp_path = tempfile.mkstemp(prefix='.' + basename + '.', dir=dirname)
+        except PermissionError:
+            # Directory is not writable, but file itself can be
+            with open(path, 'w') as file:
+                file.write(text)
+            return
+
+        try:
+            with os.fdopen(fd, 'w') as file:
+                file.write(text)
+                file.flush()
+                try:
+                    st = os.stat(path)
+                    os.fchmod(file.fileno(), stat.S_IMODE(st.st_mode))
+                    os.fchown(file.fileno(), st.st_uid, st.st_gid)
+                except FileNotFoundError:
+                    os.fchmod(file.fileno(), 0o644)
+                except PermissionError:
+                    pass
+                os.fsync(file.fileno())
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_path)
+            except OSError:
+                pass
+            raise
+
+        try:
+            dir_fd = os.open(dirname, os.O_RDONLY | os.O_DIRECTORY)
+        except OSError:
+            return
+        try:
+            os.fsync(dir_fd)
+        except OSError:
+            pass
+        finally:
+            os.close(dir_fd)
 
     def is_writable(self):
         if os.path.exists(self._output_path) and os.access(self._output_path, os.W_OK):
@@ -167,12 +676,28 @@ class Config:
         if name in self._groups:
             return self._groups[name]
         else:
-            return self._groups.setdefault(name, Config.ConfigGroup(self))
+            return self._groups.setdefault(name, Config.ConfigGroup(self, name))
 
     @property
     def key_values(self):
         return self._key_values
 
+    @property
+    def effective(self):
+        '''effective[group, key] => EffectiveValue, read only mapping.
+           Kept up to date on every change, lookups do not scan files or stacks of values.'''
+        return self._effective_view
+
+    def _update_effective(self, groupname, key):
+        group = self._groups.get(groupname)
+        values = group._items.get(key) if group else None
+        if values:
+            path, value = values[-1]
+            self._effective[groupname, key] = EffectiveValue(
+                value, path, self._lines.get((path, groupname, key)), tuple(values[:-1]))
+        else:
+            self._effective.pop((groupname, key), None)
+
     def _get_key_values(self, item):
         group = self._groups.get(item[0])
         if group:
@@ -193,7 +718,7 @@ class Config:
     def __setitem__(self, item, value):
         if isinstance(item, tuple):
             if not item[0] in self._groups:
-                self._groups[item[0]] = Config.ConfigGroup(self)
+                self._groups[item[0]] = Config.ConfigGroup(self, item[0])
             self._groups[item[0]][item[1]] = value
 
     def __delitem__(self, item):
@@ -205,10 +730,13 @@ class Config:
 
         group = self._groups.get(item)
         if group is not None:
+            self._changed_groups.add(item)
             if not group:
                 del self._groups[item]
                 return
 
+            keys = list(group._items)
+            self._changed_keys.update((item, key) for key in keys)
             keys_to_remove = []
             for key, values in group._items.items():
                 if values[-1][0] == self._output_path:
@@ -224,3 +752,6 @@ class Config:
                     del group._items[key]
             else:
                 del self._groups[item]
+
+            for key in keys:
+                self._update_effective(item, key)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2014 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Default values of [greeter] options, this module must not depend on Gtk
+
+from locale import gettext as _
+
+
+__all__ = ['GreeterDefaults']
+
+
+# key => default value, None if greeter has no fixed default
+GreeterDefaults = {
+    # Appearance
+    'theme-name': '',
+    'icon-theme-name': '',
+    'font-name': 'Sans 10',
+    'xft-antialias': None,
+    'xft-dpi': None,
+    'xft-rgba': None,
+    'xft-hintstyle': None,
+    'background': '#000000',
+    'user-background': 'true',
+    'hide-user-image': 'false',
+    'default-user-image': '#avatar-default',
+    # Panel
+    # Translators: Default clock format for your locale
+    'clock-format': _('%a, %H:%M'),
+    'indicators': '~host;~spacer;~clock;~spacer;~language;~session;~a11y;~power',
+    # Position
+    'position': '50%,center',
+    # Misc
+    'screensaver-timeout': '60',
+    'keyboard': '',
+    'reader': '',
+    'a11y-states': '',
+    'allow-debugging': 'false', }
@@ -19,15 +19,15 @@
 import collections
 import os
 import shlex
-import sys
-from functools import partialmethod
-from glob import iglob
+from bisect import bisect_left
+from functools import (
+    partial,
+    partialmethod)
 from itertools import chain
 from locale import gettext as _
 
 from gi.repository import (
     Gdk,
-    GLib,
     Gtk)
 from gi.repository import Pango
 from gi.repository.GObject import markup_escape_text as escape_markup
@@ -38,15 +38,21 @@ from lightdm_gtk_greeter_settings import (
     IconEntry,
     IndicatorsEntry,
     OptionEntry,
-    PositionEntry)
+    PositionEntry,
+    StartupProfiler)
 from lightdm_gtk_greeter_settings.helpers import (
     C_,
     string2bool,
     SimpleEnum,
     WidgetsEnum,
     WidgetsWrapper)
+from lightdm_gtk_greeter_settings.GreeterDefaults import GreeterDefaults
+from lightdm_gtk_greeter_settings.History import History
 from lightdm_gtk_greeter_settings.MonitorsGroup import MonitorsGroup
-from lightdm_gtk_greeter_settings.OptionGroup import SimpleGroup
+from lightdm_gtk_greeter_settings.OptionGroup import (
+    LazyEntry,
+    SimpleGroup)
+from lightdm_gtk_greeter_settings.ThemesIndex import ThemesIndex
 
 
 __all__ = ['GtkGreeterSettingsWindow',
@@ -59,7 +65,7 @@ class WindowMode(SimpleEnum):
     GtkHeader = 'gtk-header'
 
 
-InitialValue = collections.namedtuple('InitialValue', ('value', 'enabled'))
+InitialValue = collections.namedtuple('InitialValue', ('value', 'enabled', 'revision'))
 
 
 class GtkGreeterSettingsWindow(Gtk.Window):
@@ -77,44 +83,63 @@ class GtkGreeterSettingsWindow(Gtk.Window):
         multihead_label = 'multihead_label'
 
     def __new__(cls, mode=WindowMode.Default):
-        builder = Gtk.Builder()
-        builder.add_from_file(helpers.get_data_path('%s.ui' % cls.__name__))
-        window = builder.get_object('settings_window')
-        window.builder = builder
-        window.mode = mode
-        builder.connect_signals(window)
-        window.init_window()
+        with StartupProfiler.phase('Gtk.Builder'):
+            builder = Gtk.Builder()
+            builder.add_objects_from_file(helpers.get_data_path('%s.ui' % cls.__name__),
+                                          cls.BuilderObjects)
+            window = builder.get_object('settings_window')
+            window.builder = builder
+            window.mode = mode
+            builder.connect_signals(window)
+        with StartupProfiler.phase('init_window'):
+            window.init_window()
         return window
 
     builder = None
     mode = WindowMode.Default
 
-    GreeterGroupSetup = {
+    # Objects created with window, other pages are loaded by _load_page()
+    BuilderObjects = ('settings_window', 'icon_close', 'icon_reset', 'icon_save')
+
+    # Notebook pages created on first use: placeholder => (builder objects, [greeter] options)
+    LazyPages = {
+        'panel_page': (('panel_box', 'greeter_indicators_model'),
+                       ('clock-format', 'indicators')),
+        'position_page': (('position_box',
+                           'greeter_position_x_adjustment', 'greeter_position_y_adjustment'),
+                          ('position',)),
+        'misc_page': (('misc_box', 'greeter_screensaver-timeout_adjustment'),
+                      ('screensaver-timeout', 'keyboard', 'reader', 'a11y-states',
+                       'allow-debugging'))}
+
+    GreeterGroupEntries = {
         # Appearance
-        'theme-name': (OptionEntry.StringEntry, ''),
-        'icon-theme-name': (OptionEntry.StringEntry, ''),
-        'font-name': (OptionEntry.FontEntry, 'Sans 10'),
-        'xft-antialias': (OptionEntry.BooleanEntry, None),
-        'xft-dpi': (OptionEntry.StringEntry, None),
-        'xft-rgba': (OptionEntry.ChoiceEntry, None),
-        'xft-hintstyle': (OptionEntry.ChoiceEntry, None),
-        'background': (OptionEntry.BackgroundEntry, '#000000'),
-        'user-background': (OptionEntry.BooleanEntry, 'true'),
-        'hide-user-image': (OptionEntry.InvertedBooleanEntry, 'false'),
-        'default-user-image': (IconEntry.IconEntry, '#avatar-default'),
+        'theme-name': OptionEntry.StringEntry,
+        'icon-theme-name': OptionEntry.StringEntry,
+        'font-name': OptionEntry.FontEntry,
+        'xft-antialias': OptionEntry.BooleanEntry,
+        'xft-dpi': OptionEntry.StringEntry,
+        'xft-rgba': OptionEntry.ChoiceEntry,
+        'xft-hintstyle': OptionEntry.ChoiceEntry,
+        'background': OptionEntry.BackgroundEntry,
+        'user-background': OptionEntry.BooleanEntry,
+        'hide-user-image': OptionEntry.InvertedBooleanEntry,
+        'default-user-image': IconEntry.IconEntry,
         # Panel
-        # Translators: Default clock format for your locale
-        'clock-format': (OptionEntry.ClockFormatEntry, _('%a, %H:%M')),
-        'indicators': (IndicatorsEntry.IndicatorsEntry,
-                       '~host;~spacer;~clock;~spacer;~language;~session;~a11y;~power'),
+        'clock-format': OptionEntry.ClockFormatEntry,
+        'indicators': IndicatorsEntry.IndicatorsEntry,
         # Position
-        'position': (PositionEntry.PositionEntry, '50%,center'),
+        'position': PositionEntry.PositionEntry,
         # Misc
-        'screensaver-timeout': (OptionEntry.AdjustmentEntry, '60'),
-        'keyboard': (OptionEntry.StringPathEntry, ''),
-        'reader': (OptionEntry.StringPathEntry, ''),
-        'a11y-states': (OptionEntry.AccessibilityStatesEntry, ''),
-        'allow-debugging': (OptionEntry.BooleanEntry, 'false'), }
+        'screensaver-timeout': OptionEntry.AdjustmentEntry,
+        'keyboard': OptionEntry.StringPathEntry,
+        'reader': OptionEntry.StringPathEntry,
+        'a11y-states': OptionEntry.AccessibilityStatesEntry,
+        'allow-debugging': OptionEntry.BooleanEntry, }
+
+    # key => (entry class, default value)
+    GreeterGroupSetup = {key: (klass, GreeterDefaults[key])
+                         for key, klass in GreeterGroupEntries.items()}
 
     entries_setup = {
         ('greeter', 'allow-debugging'): ('changed',),
@@ -133,6 +158,7 @@ class GtkGreeterSettingsWindow(Gtk.Window):
             self.on_entry_removed = self.on_entry_removed_embedded
             self.on_entry_changed = self.on_entry_changed_embedded
             self._write = self._write_embedded
+            self._write_scheduler = helpers.WriteScheduler(self.on_write_timeout)
 
             self._widgets.buttons.hide()
             self._widgets.content.reorder_child(self._widgets.infobar, 0)
@@ -156,6 +182,9 @@ class GtkGreeterSettingsWindow(Gtk.Window):
             self.set_titlebar(header)
 
         self._config = Config.Config()
+        # Undo/redo of entries changes: entry => (enabled, value)
+        self._history = History()
+        self._widgets.content.connect('key-press-event', self.on_content_key_press)
 
         self._entry_menu = None
         self._initial_values = {}
@@ -165,13 +194,22 @@ class GtkGreeterSettingsWindow(Gtk.Window):
         self._new_entries = None
         self._removed_entries = None
 
+        # Entries of not loaded pages: key => LazyEntry
+        self._lazy_entries = {}
+        self._lazy_pages = dict(self.LazyPages)
+        lazy_options = set(chain.from_iterable(keys for __, keys in self.LazyPages.values()))
+        greeter_options = {key: (partial(LazyEntry, klass) if key in lazy_options else klass,
+                                 default)
+                           for key, (klass, default) in self.GreeterGroupSetup.items()}
+
         self._groups = (
-            SimpleGroup('greeter', WidgetsWrapper(self.builder, 'greeter'), self.GreeterGroupSetup),
+            SimpleGroup('greeter', WidgetsWrapper(self.builder, 'greeter'), greeter_options),
             MonitorsGroup(self.builder))
 
         for group in self._groups:
             group.entry_added.connect(self.on_entry_added)
             group.entry_removed.connect(self.on_entry_removed)
+            group.entries_changed.connect(self.on_entries_changed)
 
         self._allow_edit = self._config.is_writable()
         self._update_apply_button()
@@ -189,6 +227,7 @@ class GtkGreeterSettingsWindow(Gtk.Window):
                     message_type=Gtk.MessageType.WARNING)
 
         self._read()
+        self._config.monitor(self.on_config_files_changed)
 
     def _set_message(self, message, type_=Gtk.MessageType.INFO):
         if not message:
@@ -204,16 +243,20 @@ class GtkGreeterSettingsWindow(Gtk.Window):
         self._widgets.apply.props.sensitive = allow
 
     def _read(self):
-        self._config.read()
+        with StartupProfiler.phase('Config.read'):
+            self._config.read()
         self._changed_entries = None
         self._new_entries = None
         self._removed_entries = None
 
         for group in self._groups:
-            group.read(self._config)
+            with StartupProfiler.phase('%s.read' % group.__class__.__name__):
+                group.read(self._config)
 
-        self._initial_values = {entry: InitialValue(entry.value, entry.enabled)
+        self._initial_values = {entry: InitialValue(entry.value, entry.enabled, entry.revision)
                                 for entry in self._initial_values.keys()}
+        self._history.clear({entry: (initial.enabled, initial.value)
+                             for entry, initial in self._initial_values.items()})
 
         self._changed_entries = set()
         self._new_entries = set()
@@ -228,49 +271,160 @@ class GtkGreeterSettingsWindow(Gtk.Window):
 
         if self.mode != WindowMode.Embedded:
             for entry in changed:
-                self._initial_values[entry] = InitialValue(entry.value, entry.enabled)
+                self._initial_values[entry] = InitialValue(entry.value, entry.enabled,
+                                                           entry.revision)
 
         self._changed_entries.clear()
         self._new_entries.clear()
         self._removed_entries.clear()
 
         try:
-            self._config.write()
+            if self.mode == WindowMode.Embedded:
+                self._config.write(self._config.changed_groups)
+            else:
+                self._config.write()
         except OSError as e:
             helpers.show_message(e, Gtk.MessageType.ERROR)
 
         self._update_apply_button()
 
-    _write_timeout_id = None
+    _write_scheduler = None
 
-    def _write_embedded(self, delay=750):
-        if self._write_timeout_id:
-            GLib.Source.remove(self._write_timeout_id)
-        if delay:
-            self._write_timeout_id = GLib.timeout_add(delay, self.on_write_timeout)
-        else:
-            self._write_timeout_id = None
-            self.on_write_timeout()
+    def _write_embedded(self):
+        self._write_scheduler.schedule()
 
     def on_write_timeout(self):
-        self._write_timeout_id = None
         self.__class__._write(self)
-        return False
+
+    def flush(self):
+        '''Writes pending changes immediately'''
+        if self._write_scheduler:
+            self._write_scheduler.flush()
+
+    def _find_entry(self, groupname, key):
+        '''Returns (group, entry) for option or (None, None)'''
+        for group in self._groups:
+            subgroups = group.groups if isinstance(group, MonitorsGroup) else (group,)
+            for subgroup in subgroups:
+                if subgroup.name == groupname:
+                    entry = subgroup.entries[key]
+                    return (subgroup, entry) if entry else (None, None)
+        return None, None
+
+    def on_config_files_changed(self, changed, conflicts):
+        '''Configuration files are changed by other program: entries without unsaved changes
+           are updated, unsaved changes are kept and reported'''
+        conflicted = set(conflicts)
+        updates = collections.defaultdict(list)
+        read_monitors = False
+        for groupname, key in changed:
+            group, entry = self._find_entry(groupname, key)
+            if entry is None:
+                read_monitors |= groupname.startswith(MonitorsGroup.GroupPrefix)
+            elif entry in self._changed_entries or (groupname, key) in conflicts:
+                conflicted.add((groupname, key))
+                # "Reset to initial value" restores new value from file
+                value = self._config[groupname, key]
+                self._initial_values[entry] = InitialValue(
+                    value if value is not None else group.defaults[key], value is not None, -1)
+            else:
+                updates[group].append((key, entry))
+
+        monitors = self._groups[1]
+        if read_monitors and (self._new_entries or self._removed_entries or
+                              any(entry in self._changed_entries
+                                  for entry in monitors._get_entries())):
+            conflicted.update((groupname, key) for groupname, key in changed
+                              if groupname.startswith(MonitorsGroup.GroupPrefix))
+            read_monitors = False
+
+        if updates or read_monitors:
+            # Changes made here are not made by user
+            pending = self._changed_entries, self._new_entries, self._removed_entries
+            self._changed_entries = self._new_entries = self._removed_entries = None
+            try:
+                for group, entries in updates.items():
+                    with group.bulk_update():
+                        for key, entry in entries:
+                            value = self._config[group.name, key]
+                            entry.value = value if value is not None else group.defaults[key]
+                            entry.enabled = value is not None
+                if read_monitors:
+                    for entry in monitors._get_entries():
+                        self._initial_values.pop(entry, None)
+                    monitors.read(self._config)
+            finally:
+                self._changed_entries, self._new_entries, self._removed_entries = pending
+
+            updated = chain.from_iterable(updates.values())
+            if read_monitors:
+                updated = chain(updated, ((None, entry) for entry in monitors._get_entries()))
+            for __, entry in updated:
+                self._initial_values[entry] = InitialValue(entry.value, entry.enabled,
+                                                           entry.revision)
+                self._history.set_initial(entry, (entry.enabled, entry.value))
+
+        if conflicted:
+            options = ', '.join(sorted('[{group}] {key}'.format(group=group, key=key)
+                                       for group, key in conflicted))
+            self._set_message(_('Configuration was changed by another program, your changes '
+                                'are not saved: {options}').format(options=options),
+                              Gtk.MessageType.WARNING)
+        elif updates or read_monitors:
+            self._set_message(_('Configuration was changed by another program and reloaded'))
+
+        self._update_apply_button()
+
+    @StartupProfiler.timed('_load_page')
+    def _load_page(self, name):
+        objects, keys = self._lazy_pages.pop(name)
+        self.builder.add_objects_from_file(
+            helpers.get_data_path('%s.ui' % self.__class__.__name__), objects)
+        self.builder.get_object(name).pack_start(self.builder.get_object(objects[0]),
+                                                 True, True, 0)
+
+        for key in keys:
+            entry = self._lazy_entries.pop(key, None)
+            if not entry:
+                continue
+            entry.materialize()
+            self._setup_entry(entry, 'greeter', key, ('setup',))
+            # Widgets can normalize value, it is not a change made by user
+            if self._changed_entries is not None and entry not in self._changed_entries:
+                self._initial_values[entry] = InitialValue(entry.value, entry.enabled,
+                                                           entry.revision)
+            self._history.set_initial(entry, (entry.enabled, entry.value))
+
+    def _setup_entry(self, entry, group, key, actions):
+        for action in self.entries_setup.get((group, key), ()):
+            if action not in actions:
+                continue
+            fname = 'on_entry_%s_%s_%s' % (action, group, key)
+            f = getattr(self, fname.replace('-', '_'))
+            if action == 'setup':
+                f(entry)
+            else:
+                entry.connect(action, f)
+
+    def on_notebook_switch_page(self, notebook, page, index):
+        name = Gtk.Buildable.get_name(page)
+        if name in self._lazy_pages:
+            self._load_page(name)
 
     def on_entry_added(self, group, source, entry, key):
-        if isinstance(source, SimpleGroup) and (source.name, key) in self.entries_setup:
-            for action in self.entries_setup[(source.name, key)]:
-                fname = 'on_entry_%s_%s_%s' % (action, source.name, key)
-                f = getattr(self, fname.replace('-', '_'))
-                if action == 'setup':
-                    f(entry)
-                else:
-                    entry.connect(action, f)
+        if isinstance(source, SimpleGroup):
+            if isinstance(entry, LazyEntry) and not entry.materialized:
+                # Widgets are required for "setup", it is called by _load_page()
+                self._lazy_entries[key] = entry
+                self._setup_entry(entry, source.name, key, ('changed', 'get', 'set'))
+            else:
+                self._setup_entry(entry, source.name, key, ('setup', 'changed', 'get', 'set'))
 
         entry.show_menu.connect(self.on_show_menu, source, key)
         entry.changed.connect(self.on_entry_changed)
 
-        self._initial_values[entry] = InitialValue(entry.value, entry.enabled)
+        self._initial_values[entry] = InitialValue(entry.value, entry.enabled, entry.revision)
+        self._history.set_initial(entry, (entry.enabled, entry.value))
         self.on_entry_changed(entry, forced=True)
 
         if self._new_entries is not None:
@@ -281,6 +435,7 @@ class GtkGreeterSettingsWindow(Gtk.Window):
             return
 
         self._initial_values.pop(entry, None)
+        self._history.forget(entry)
         if entry in self._new_entries:
             self._new_entries.discard(entry)
             self._changed_entries.discard(entry)
@@ -294,6 +449,7 @@ class GtkGreeterSettingsWindow(Gtk.Window):
             return
 
         self._initial_values.pop(entry, None)
+        self._history.forget(entry)
         self._removed_entries.add(entry)
         if self._allow_edit:
             self._write()
@@ -302,21 +458,50 @@ class GtkGreeterSettingsWindow(Gtk.Window):
         if self._changed_entries is None:
             return
 
+        self._history.changed(entry, (entry.enabled, entry.value))
         initial = self._initial_values[entry]
         if forced or entry.enabled != initial.enabled or \
-           (entry.enabled and entry.value != initial.value):
+           (entry.enabled and entry.revision != initial.revision and
+                entry.value != initial.value):
             self._changed_entries.add(entry)
         else:
             self._changed_entries.discard(entry)
 
-        self._update_apply_button()
+        # Button is updated once by on_entries_changed() at the end of bulk update
+        if not any(group.in_bulk_update for group in self._groups):
+            self._update_apply_button()
+
+    def on_entries_changed(self, group, entries):
+        if self._changed_entries is not None:
+            self._update_apply_button()
 
     def on_entry_changed_embedded(self, entry, forced=False):
         if self._changed_entries is not None:
+            self._history.changed(entry, (entry.enabled, entry.value))
             self._changed_entries.add(entry)
             if self._allow_edit:
                 self._write()
 
+    def on_content_key_press(self, widget, event):
+        modifiers = event.state & Gtk.accelerator_get_default_mod_mask()
+        keyval = Gdk.keyval_to_lower(event.keyval)
+        control = Gdk.ModifierType.CONTROL_MASK
+        if keyval == Gdk.KEY_z and modifiers == control:
+            return self._history.undo(self._set_entry_state)
+        if (keyval == Gdk.KEY_z and modifiers == control | Gdk.ModifierType.SHIFT_MASK) or \
+           (keyval == Gdk.KEY_y and modifiers == control):
+            return self._history.redo(self._set_entry_state)
+        return False
+
+    @staticmethod
+    def _set_entry_state(entry, state):
+        '''Applies (enabled, value) state stored by history'''
+        enabled, value = state
+        with entry.bulk_update():
+            if value is not None:
+                entry.value = value
+            entry.enabled = enabled
+
     def on_entry_reset_clicked(self, item):
         entry, value, enabled = item._reset_entry_data
         if enabled is None:
@@ -396,12 +581,16 @@ class GtkGreeterSettingsWindow(Gtk.Window):
             menu.value.props.label = '# {key} ='.format(key=key)
 
         # File with key definition
-        config_values = self._config.key_values[group.name, key]
+        effective = self._config.effective.get((group.name, key))
         if entry not in self._changed_entries and \
-           config_values and config_values[-1][0] != helpers.get_config_path():
+           effective and effective.path != helpers.get_config_path():
             menu.file.props.label = _('Value defined in file: {path}')\
-                .format(path=escape_markup(config_values[-1][0]))
-            menu.file.set_tooltip_text(config_values[-1][0])
+                .format(path=escape_markup(effective.path))
+            if effective.line is not None:
+                menu.file.set_tooltip_text('{path}:{line}'.format(path=effective.path,
+                                                                  line=effective.line))
+            else:
+                menu.file.set_tooltip_text(effective.path)
             menu.file.show()
         else:
             menu.file.hide()
@@ -454,9 +643,9 @@ class GtkGreeterSettingsWindow(Gtk.Window):
 
         # Reset to values from all other (.conf
         item_idx = 0
-        if config_values and len(config_values) > 1:
+        if effective and effective.shadowed:
             values = {None, default, self._initial_values[entry].value, entry.value}
-            for __, value in config_values[:-1]:
+            for __, value in effective.shadowed:
                 if value in values:
                     continue
 
@@ -525,37 +714,39 @@ class GtkGreeterSettingsWindow(Gtk.Window):
 
     # [greeter] theme-name
     # LP: #1709864, Support gtk-3.* themes
-    GtkThemesPattern = (sys.prefix, 'share', 'themes', '*', 'gtk-3.*', 'gtk.css')
+    GtkThemes = ThemesIndex('gtk', 'themes', ('gtk-3.*', 'gtk.css'))
 
-    def on_entry_setup_greeter_theme_name(self, entry, pattern=GtkThemesPattern):
+    def on_entry_setup_greeter_theme_name(self, entry, index=GtkThemes):
         values = entry.widgets['values']
-        themes = []
-        idx = pattern.index('*') - len(pattern)
-        for path in sorted(iglob(os.path.join(*pattern))):
-            theme = path.split(os.path.sep)[idx]
-            if theme not in themes:
-                themes.append(theme)
+        keys = []
 
-        themes = sorted(themes, key=lambda theme: theme.lower())
+        def on_themes_found(themes):
+            for theme in themes:
+                key = theme.lower(), theme
+                idx = bisect_left(keys, key)
+                if idx < len(keys) and keys[idx] == key:
+                    continue
+                keys.insert(idx, key)
+                values.insert_text(idx, theme)
+            # Theme could be found in another directory
+            self.on_entry_changed_greeter_theme_name(entry, index)
 
-        for theme in themes:
-            values.append_text(theme)
+        index.load(on_themes_found)
 
-    def on_entry_changed_greeter_theme_name(self, entry, pattern=GtkThemesPattern):
+    def on_entry_changed_greeter_theme_name(self, entry, index=GtkThemes):
         value = entry.value
         if value:
-            path = (p if p != '*' else value.strip() for p in pattern)
-            entry.error = helpers.check_path_accessibility(os.path.join(*path))
+            entry.error = helpers.check_path_accessibility(index.get_path(value.strip()))
         else:
             entry.error = None
 
     # [greeter] icon-theme-name
-    IconThemesPattern = (sys.prefix, 'share', 'icons', '*', 'index.theme')
+    IconThemes = ThemesIndex('icons', 'icons', ('index.theme',))
     on_entry_setup_greeter_icon_theme_name = partialmethod(on_entry_setup_greeter_theme_name,
-                                                           pattern=IconThemesPattern)
+                                                           index=IconThemes)
 
     on_entry_changed_greeter_icon_theme_name = partialmethod(on_entry_changed_greeter_theme_name,
-                                                             pattern=IconThemesPattern)
+                                                             index=IconThemes)
 
     # [greeter] allow-debugging
     def on_entry_changed_greeter_allow_debugging(self, entry):
@@ -611,8 +802,8 @@ class GtkGreeterSettingsWindow(Gtk.Window):
         return False
 
     def on_destroy(self, widget, write=False):
-        if write and self._write_timeout_id:
-            self._write_embedded(delay=None)
+        if write:
+            self.flush()
         Gtk.main_quit()
 
     def on_apply_clicked(self, *unused):
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2014 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import time
+from collections import deque
+from contextlib import contextmanager
+
+
+__all__ = ['History']
+
+
+class History:
+    '''Undo/redo steps for key => value mapping.
+       Only current values are stored in full, every step keeps changed keys only:
+       {key: (old value, new value)}. Number of steps is limited.'''
+
+    def __init__(self, limit=200, coalesce_timeout=0.75):
+        self._coalesce_timeout = coalesce_timeout
+        # key => current value
+        self._values = {}
+        self._undo = deque(maxlen=limit)
+        self._redo = []
+        # (key, time) of the last change, following changes of this key are merged with it
+        self._last_change = None
+        self._applying = False
+
+    def clear(self, values=None):
+        '''Removes all steps, "values" is {key: value} of new initial state'''
+        self._values.clear()
+        if values:
+            self._values.update(values)
+        self._undo.clear()
+        self._redo.clear()
+        self._last_change = None
+
+    def set_initial(self, key, value):
+        '''Sets current value of key without adding new step'''
+        self._values[key] = value
+
+    def forget(self, key):
+        '''Removes key from all steps'''
+        self._values.pop(key, None)
+        for steps in (self._undo, self._redo):
+            for step in steps:
+                step.pop(key, None)
+            kept = [step for step in steps if step]
+            if len(kept) != len(steps):
+                steps.clear()
+                steps.extend(kept)
+        self._last_change = None
+
+    def changed(self, key, value):
+        '''Value of key is changed: adds new step or updates the last one if the same key
+           was changed recently. Does nothing while undo() or redo() is applied.'''
+        old = self._values.get(key, value)
+        self._values[key] = value
+        if self._applying or old == value:
+            return
+
+        now = time.monotonic()
+        last = self._last_change
+        if last and last[0] == key and now - last[1] < self._coalesce_timeout and self._undo:
+            step = self._undo[-1]
+            first = step[key][0]
+            if first != value:
+                step[key] = first, value
+                self._last_change = key, now
+                return
+            # Value is returned to the state before step
+            del step[key]
+            if not step:
+                self._undo.pop()
+            self._last_change = None
+            return
+
+        self._undo.append({key: (old, value)})
+        self._redo.clear()
+        self._last_change = key, now
+
+    @property
+    def can_undo(self):
+        return bool(self._undo)
+
+    @property
+    def can_redo(self):
+        return bool(self._redo)
+
+    def undo(self, apply):
+        '''Calls apply(key, value) for every key of the last step'''
+        if not self._undo:
+            return False
+        step = self._undo.pop()
+        self._redo.append(step)
+        self._apply(apply, ((key, old) for key, (old, __) in step.items()))
+        return True
+
+    def redo(self, apply):
+        '''Calls apply(key, value) for every key of the last undone step'''
+        if not self._redo:
+            return False
+        step = self._redo.pop()
+        self._undo.append(step)
+        self._apply(apply, ((key, new) for key, (__, new) in step.items()))
+        return True
+
+    def _apply(self, apply, values):
+        self._last_change = None
+        with self._applying_block():
+            for key, value in values:
+                self._values[key] = value
+                apply(key, value)
+
+    @contextmanager
+    def _applying_block(self):
+        self._applying = True
+        try:
+            yield
+        finally:
+            self._applying = False
@@ -16,11 +16,18 @@
 #   with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+import json
+import os
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+
 from gi.repository import (
-    GObject,
+    GLib,
     Gtk)
 
 from lightdm_gtk_greeter_settings.helpers import (
+    get_cache_path,
     get_data_path,
     NC_,
     SimpleEnum,
@@ -42,6 +49,61 @@ class IconRow(SimpleEnum):
     Context = ()
 
 
+class IconNamesIndex:
+    '''Sorted array of icon names with prefix and trigram lookup'''
+
+    def __init__(self, names):
+        '''Names must be sorted case-insensitively'''
+        self._keys = [name.lower() for name in names]
+        self._trigrams = {}
+        self._trigrams_count = 0
+        self._last_search = None
+
+    @staticmethod
+    def _get_trigrams(key):
+        return {key[i:i + 3] for i in range(len(key) - 2)}
+
+    def add_trigrams(self, count):
+        '''Adds next `count` names to trigram index, returns False when all names are indexed'''
+        start = self._trigrams_count
+        stop = min(start + count, len(self._keys))
+        trigrams = self._trigrams
+        for i in range(start, stop):
+            for trigram in self._get_trigrams(self._keys[i]):
+                postings = trigrams.get(trigram)
+                if postings is None:
+                    trigrams[trigram] = [i]
+                else:
+                    postings.append(i)
+        self._trigrams_count = stop
+        return stop < len(self._keys)
+
+    def search(self, text):
+        '''Returns indices of names containing text: names starting with text first,
+           then other matches, both in sorted order'''
+        text = text.lower()
+        keys = self._keys
+
+        # Prefix matches are a contiguous range of sorted array
+        first = bisect_left(keys, text)
+        last = bisect_left(keys, text + '\U0010ffff', first)
+
+        # Narrowing previous result when user continues typing
+        if self._last_search and self._last_search[0] in text:
+            candidates = sorted(self._last_search[1])
+        elif len(text) >= 3 and self._trigrams_count == len(keys):
+            postings = sorted((self._trigrams.get(trigram, ())
+                               for trigram in self._get_trigrams(text)), key=len)
+            candidates = sorted(set(postings[0]).intersection(*postings[1:]))
+        else:
+            candidates = range(len(keys))
+
+        result = list(range(first, last))
+        result += (i for i in candidates if (i < first or i >= last) and text in keys[i])
+        self._last_search = (text, result)
+        return result
+
+
 class IconChooserDialog(Gtk.Dialog):
 
     __gtype_name__ = 'IconChooserDialog'
@@ -57,6 +119,8 @@ class IconChooserDialog(Gtk.Dialog):
 
     class Widgets(WidgetsEnum):
         name = 'name_entry'
+        name_completion = 'name_completion'
+        search = 'search_entry'
         preview = 'preview_image'
         standard = 'standard_toggle'
         ok = 'ok_button'
@@ -68,36 +132,49 @@ class IconChooserDialog(Gtk.Dialog):
         icons_view = 'icons_view'
         icons_selection = 'icons_selection'
         icons_model = 'icons_model'
-        icons_sorted = 'icons_sorted'
-        icons_filter = 'icons_filter'
 
     builder = None
 
+    # Main loop time for single portion of icons, seconds
+    ReadChunkTime = 0.02
+    # Number of icons added between checks of time
+    ReadChunkSize = 250
+    # Maximum number of icons shown for search text
+    SearchLimit = 1000
+
     def init_window(self):
         self._widgets = self.Widgets(builder=self.builder)
-        self._widgets_to_disable = (self._widgets.name, self._widgets.standard,
-                                    self._widgets.contexts_view, self._widgets.icons_view,
-                                    self._widgets.ok, self._widgets.cancel)
 
         self._icons_loaded = False
+        self._icons_reader = None
+        self._icons = None
+        self._icons_index = None
+        # {(context, standard only): model}, all icons model is also used by name completion
+        self._icons_partitions = {}
+        self._icons_view_model = None
         self._icon_to_select = None
         self._icon_filter_standard = True
         self._icon_filter_context = None
+        # Generator adding rows to current search model, used by idle callback
+        self._search_filler = None
+        self._search_source = None
 
         self._widgets.contexts_view.set_row_separator_func(self._contexts_separator_callback, None)
         self._widgets.contexts_filter.set_visible_func(self._contexts_visible_callback)
 
-        self._widgets.icons_filter.set_visible_func(self._icons_filter_visible_callback)
-        self._widgets.icons_sorted.set_sort_column_id(0, Gtk.SortType.ASCENDING)
-
         self._reload()
 
     def _reload(self):
-        for w in self._widgets_to_disable:
-            w.props.sensitive = False
-        GObject.idle_add(self._read_icons)
-
-    def _read_icons(self):
+        self._icons_loaded = False
+        self._icons = None
+        self._icons_index = None
+        self._icons_partitions = {}
+        self._icons_view_model = None
+        self._read_contexts()
+        self._icons_reader = self._read_icons()
+        GLib.idle_add(self._on_read_icons_idle)
+
+    def _read_contexts(self):
         theme = Gtk.IconTheme.get_default()
         standard_contexts = set(name for name, title in StandardContexts)
 
@@ -111,19 +188,156 @@ class IconChooserDialog(Gtk.Dialog):
                 row = ContextRow._make(Name=name, Standard=False, Title=name)
                 self._widgets.contexts_model.append(row)
 
-        self._widgets.icons_model.clear()
-        for context in theme.list_contexts():
-            for icon in theme.list_icons(context):
-                row = IconRow._make(Name=icon, Standard=icon in StandardIconNames, Context=context)
-                self._widgets.icons_model.append(row)
-
+    def _read_icons(self):
+        model = self._widgets.icons_model
+        model.clear()
+
+        key, path = self._get_icons_index()
+        icons = self._load_icons_index(path, key)
+        if icons is None:
+            icons = []
+            theme = Gtk.IconTheme.get_default()
+            for context in theme.list_contexts():
+                icons += ((icon, icon in StandardIconNames, context)
+                          for icon in theme.list_icons(context))
+                yield
+            self._save_icons_index(path, key, icons)
+
+        icons.sort(key=lambda icon: (icon[IconRow.Name].lower(), icon[IconRow.Context]))
+
+        partitions = {}
+        for i, (__, standard, context) in enumerate(icons):
+            for key in ((None, False), (context, False)) + \
+                    (((None, True), (context, True)) if standard else ()):
+                indices = partitions.get(key)
+                if indices is None:
+                    partitions[key] = [i]
+                else:
+                    indices.append(i)
+
+        # Partitions and search are available before trigrams index is built,
+        # search scans all names until then
+        self._icons = icons
+        self._icons_index = IconNamesIndex(icon[IconRow.Name] for icon in icons)
+        self._icons_partitions = {key: model if key == (None, False)
+                                  else Gtk.ListStore(str, bool, str)
+                                  for key in partitions}
+        self._icons_view_model = self._get_icons_view_model()
+
+        # Small "standard only" partitions first, they are shown by default
+        columns = (IconRow.Name, IconRow.Standard, IconRow.Context)
+        for key in sorted(partitions,
+                          key=lambda key: (not key[1], key[0] is not None, key[0] or '')):
+            partition = self._icons_partitions[key]
+            indices = partitions[key]
+            for i in range(0, len(indices), self.ReadChunkSize):
+                for j in indices[i:i + self.ReadChunkSize]:
+                    partition.insert_with_valuesv(-1, columns, icons[j])
+                yield
+
+        while self._icons_index.add_trigrams(self.ReadChunkSize * 4):
+            yield
+
+    IconsIndexVersion = 1
+
+    def _get_icons_index(self):
+        '''Returns (key, path) of icons index file for current icon theme.
+           Key contains modification times of all index.theme and icon-theme.cache files
+           of theme and its parents.'''
+        name = Gtk.Settings.get_default().props.gtk_icon_theme_name or 'hicolor'
+        search_path = Gtk.IconTheme.get_default().get_search_path()
+
+        def mtime(path):
+            try:
+                return os.stat(path).st_mtime_ns
+            except OSError:
+                return None
+
+        files = [(path, mtime(path)) for path in search_path]
+        themes = [name, 'hicolor']
+        for theme in themes:
+            for directory in search_path:
+                for filename in ('index.theme', 'icon-theme.cache'):
+                    path = os.path.join(directory, theme, filename)
+                    file_mtime = mtime(path)
+                    if file_mtime is None:
+                        continue
+                    files.append((path, file_mtime))
+                    if filename == 'index.theme':
+                        themes += (parent for parent in self._get_icon_theme_parents(path)
+                                   if parent not in themes)
+
+        key = json.dumps([self.IconsIndexVersion, name, files])
+        return key, get_cache_path('icons-%s.index' % name.replace(os.sep, '_'))
+
+    @staticmethod
+    def _get_icon_theme_parents(path):
+        keyfile = GLib.KeyFile()
+        try:
+            keyfile.load_from_file(path, GLib.KeyFileFlags.NONE)
+            return keyfile.get_string_list('Icon Theme', 'Inherits')
+        except GLib.Error:
+            return ()
+
+    @staticmethod
+    def _load_icons_index(path, key):
+        '''Returns [(name, standard, context), ...] or None if index is missing or outdated'''
+        try:
+            with open(path) as file:
+                lines = file.read().split('\n')
+        except (OSError, UnicodeDecodeError):
+            return None
+        if lines[0] != key:
+            return None
+        try:
+            return [(name, standard == '1', context)
+                    for name, context, standard in (line.split('\t') for line in lines[1:] if line)]
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _save_icons_index(path, key, icons):
+        lines = [key]
+        lines += ('%s\t%s\t%d' % (name, context, standard) for name, standard, context in icons)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as file:
+                file.write('\n'.join(lines))
+                file.write('\n')
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
+
+    @contextmanager
+    def _detached_icons_view(self):
+        '''Detaches view and completion to avoid updating them for every new row'''
+        view = self._widgets.icons_view
+        selected_model, selected = self._widgets.icons_selection.get_selected()
+        scroll = view.get_vadjustment().props.value
+        view.props.model = None
+        self._widgets.name_completion.props.model = None
+        try:
+            yield
+        finally:
+            self._widgets.name_completion.props.model = self._widgets.icons_model
+            view.props.model = self._icons_view_model
+            if selected:
+                self._restore_icon_selection(selected_model, selected)
+            view.get_vadjustment().props.value = scroll
+
+    def _on_read_icons_idle(self):
+        deadline = time.monotonic() + self.ReadChunkTime
+
+        with self._detached_icons_view():
+            for __ in self._icons_reader:
+                if time.monotonic() > deadline:
+                    return True
+
+        self._icons_reader = None
         self._icons_loaded = True
-        if self._icon_to_select:
+        if self._icon_to_select and self._widgets.name.props.text == self._icon_to_select:
             self.select_icon(self._icon_to_select)
-            self._icon_to_select = None
-
-        for w in self._widgets_to_disable:
-            w.props.sensitive = True
+        self._icon_to_select = None
 
         return False
 
@@ -132,13 +346,68 @@ class IconChooserDialog(Gtk.Dialog):
         self._update_icons_filter()
 
     def _update_icons_filter(self):
-        self._widgets.icons_view.props.model = None
         model, rowiter = self._widgets.contexts_selection.get_selected()
         if rowiter:
             self._icon_filter_standard = self._widgets.standard.props.active
             self._icon_filter_context = model[rowiter][ContextRow.Name]
-            self._widgets.icons_filter.refilter()
-            self._widgets.icons_view.props.model = self._widgets.icons_sorted
+            self._icons_view_model = self._get_icons_view_model()
+        else:
+            self._icons_view_model = None
+        self._widgets.icons_view.props.model = self._icons_view_model
+
+    def _get_icons_view_model(self):
+        self._search_filler = None
+        if not self._icons_partitions:
+            return None
+        text = self._widgets.search.props.text.strip()
+        if text:
+            return self._get_search_model(text)
+        return self._icons_partitions.get((self._icon_filter_context, self._icon_filter_standard))
+
+    def _get_search_model(self, text):
+        '''Returns new model with icons matching search text and current filter.
+           First portion of rows is added immediately, others by idle callback.'''
+        model = Gtk.ListStore(str, bool, str)
+        filler = self._fill_search_model(model, text)
+        try:
+            next(filler)
+        except StopIteration:
+            return model
+
+        self._search_filler = filler
+        if self._search_source is None:
+            self._search_source = GLib.idle_add(self._on_fill_search_idle)
+        return model
+
+    def _fill_search_model(self, model, text):
+        '''Adds up to SearchLimit matching icons to model, yields after every portion'''
+        standard = self._icon_filter_standard
+        context = self._icon_filter_context
+        icons = self._icons
+        columns = (IconRow.Name, IconRow.Standard, IconRow.Context)
+        added = 0
+        for checked, i in enumerate(self._icons_index.search(text), 1):
+            icon = icons[i]
+            if (not standard or icon[IconRow.Standard]) and \
+               (not context or icon[IconRow.Context] == context):
+                model.insert_with_valuesv(-1, columns, icon)
+                added += 1
+                if added == self.SearchLimit:
+                    return
+            if checked % self.ReadChunkSize == 0:
+                yield
+
+    def _on_fill_search_idle(self):
+        deadline = time.monotonic() + self.ReadChunkTime
+
+        with self._detached_icons_view():
+            for __ in self._search_filler or ():
+                if time.monotonic() > deadline:
+                    return True
+
+        self._search_filler = None
+        self._search_source = None
+        return False
 
     def _contexts_visible_callback(self, model, rowiter, data):
         if not self._widgets.standard.props.active:
@@ -148,32 +417,40 @@ class IconChooserDialog(Gtk.Dialog):
     def _contexts_separator_callback(self, model, rowiter, data):
         return not model[rowiter][ContextRow.Name] and not model[rowiter][ContextRow.Title]
 
-    def _icons_filter_visible_callback(self, model, rowiter, data):
-        if self._icon_filter_standard and not model[rowiter][IconRow.Standard]:
-            return False
-        if not self._icon_filter_context:
-            return True
-        return model[rowiter][IconRow.Context] == self._icon_filter_context
-
     def get_selected_icon(self):
         return self._widgets.name.props.text
 
     def select_icon(self, name):
         if not self._icons_loaded:
             self._icon_to_select = name
+            self._widgets.name.props.text = name
             return
 
         if name not in StandardIconNames:
             self._widgets.standard.props.active = False
         self._widgets.contexts_selection.select_path(0)
 
-        for row in self._widgets.icons_sorted:
+        if not self._select_icon_row(name):
+            self._widgets.name.props.text = name
+
+    def _restore_icon_selection(self, model, rowiter):
+        '''Selects row again after view model is reattached. Rows of ListStore are
+           only appended while loading, so iter is still valid for the same model.'''
+        if model is not self._icons_view_model:
+            self._select_icon_row(model[rowiter][IconRow.Name])
+            return
+        path = model.get_path(rowiter)
+        self._widgets.icons_view.set_cursor(path)
+        self._widgets.icons_selection.select_iter(rowiter)
+
+    def _select_icon_row(self, name):
+        model = self._widgets.icons_view.props.model
+        for row in model or ():
             if row[IconRow.Name] == name:
                 self._widgets.icons_view.set_cursor(row.path)
                 self._widgets.icons_selection.select_path(row.path)
-                break
-        else:
-            self._widgets.name.props.text = name
+                return True
+        return False
 
     def on_icons_selection_changed(self, selection):
         model, rowiter = selection.get_selected()
@@ -187,6 +464,10 @@ class IconChooserDialog(Gtk.Dialog):
     def on_standard_toggled(self, toggle):
         self._update_contexts_filter()
 
+    def on_search_changed(self, entry):
+        self._widgets.icons_selection.unselect_all()
+        self._update_icons_filter()
+
     def on_name_changed(self, entry):
         name = entry.props.text
         if not Gtk.IconTheme.get_default().has_icon(name):
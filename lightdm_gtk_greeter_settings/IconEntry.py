@@ -24,6 +24,7 @@ from lightdm_gtk_greeter_settings.OptionEntry import BaseEntry
 from lightdm_gtk_greeter_settings.helpers import (
     C_,
     get_data_path,
+    ImagePreviewLoader,
     set_image_from_path,
     SimpleEnum)
 
@@ -50,6 +51,7 @@ class IconEntry(BaseEntry):
         self._button.props.popup = Gtk.Menu()
         self._icon_dialog = None
         self._path_dialog = None
+        self._path_preview = None
         self._current_item = None
 
         self._add_controlled_by_state_widget(self._button)
@@ -146,6 +148,7 @@ class IconEntry(BaseEntry):
             preview = self._path_dialog.props.preview_widget
             preview.props.pixel_size = preview_size
             preview.set_size_request(preview_size, preview_size)
+            self._path_preview = ImagePreviewLoader(preview)
 
         if oldvalue is not None:
             self._path_dialog.select_filename(self._value)
@@ -154,7 +157,8 @@ class IconEntry(BaseEntry):
         if self._path_dialog.run() == Gtk.ResponseType.OK:
             value = self._path_dialog.get_filename()
         self._path_dialog.hide()
+        self._path_preview.cancel()
         return value
 
     def _on_update_path_preview(self, chooser):
-        set_image_from_path(chooser.props.preview_widget, chooser.get_filename())
+        self._path_preview.load(chooser.get_filename())
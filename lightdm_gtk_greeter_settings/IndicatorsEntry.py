@@ -17,6 +17,7 @@
 
 import operator
 import platform
+import re
 import string
 from copy import deepcopy
 
@@ -56,6 +57,20 @@ class Indicators(SimpleEnum):
     Power = '~power'
 
 
+# Regular expressions for IndicatorsEntry._next_string_token()
+_name_delimiters = re.compile('[":;]')
+_option_delimiters = re.compile('["=,;]')
+_value_delimiters = re.compile('[",;]')
+_spaces_regex = re.compile(r'\s*')
+
+
+def _escape_token(s):
+    s = s.replace('"', r'\"')
+    if any(c in s for c in string.whitespace):
+        s = '"' + s + '"'
+    return s
+
+
 # Valid builtin indicators
 BuiltInIndicators = set(Indicators) - {Indicators.External}
 
@@ -224,51 +239,50 @@ class IndicatorsEntry(BaseEntry):
             self._emit_changed()
 
     def _get_value(self):
-        def fix_token(s):
-            s = s.replace('"', r'\"')
-            if any(c in s for c in string.whitespace):
-                s = '"' + s + '"'
-            return s
-
         items = []
         for row in self._model:
             if row[Row.HasState] and not row[Row.State]:
                 continue
+            # Options wrapper is replaced on every change of row options
+            wrapper = row[Row.Options]
+            fragment = getattr(wrapper, 'fragment', None)
+            if fragment is None:
+                fragment = wrapper.fragment = self._format_options(wrapper.data)
+            items.append(fragment)
+        return '; '.join(items)
 
-            options = deepcopy(row[Row.Options].data)
-            name = options.pop(Option.Name)
-            defaults = deepcopy(self.DefaultOptions[name])
+    def _format_options(self, options):
+        name = options[Option.Name]
+        defaults = self.DefaultOptions[name]
 
+        values = {}
+        for k, v in options.items():
             # text, image, layout=image-text -> text, image
-            if options.get(Option.Layout) == {LayoutSet.Text, LayoutSet.Image}:
-                del options[Option.Layout]
-
-            for k in defaults.keys() & options.keys():
-                if defaults[k] == options[k]:
-                    del options[k]
-
-            if Option.Layout in options:
-                layout = options[Option.Layout]
-                options[Option.Layout] = LayoutSet._to_string(layout)
-                # text, layout=text -> layout=text
-                if LayoutSet.Text in layout and options.get(Option.Text, self) is None:
-                    del options[Option.Text]
-                if LayoutSet.Image in layout and options.get(Option.Image, self) is None:
-                    del options[Option.Image]
-
-            # name=~text, text=value -> ~~value
-            if name == Indicators.Text:
-                name = '~~' + (options.pop(Option.Text, None) or '')
-            elif name == Indicators.External:
-                name = options.pop(Option.Path, None) or ''
-
-            if not options:
-                items.append(fix_token(name))
-            else:
-                values = (fix_token(k) + '=' + fix_token(v) if v else fix_token(k)
-                          for k, v in sorted(options.items(), key=operator.itemgetter(0)))
-                items.append(fix_token(name) + ': ' + ', '.join(values))
-        return '; '.join(items)
+            if k == Option.Name or k == Option.Layout and v == {LayoutSet.Text, LayoutSet.Image}:
+                continue
+            if k not in defaults or defaults[k] != v:
+                values[k] = v
+
+        if Option.Layout in values:
+            layout = values[Option.Layout]
+            values[Option.Layout] = LayoutSet._to_string(layout)
+            # text, layout=text -> layout=text
+            if LayoutSet.Text in layout and values.get(Option.Text, self) is None:
+                del values[Option.Text]
+            if LayoutSet.Image in layout and values.get(Option.Image, self) is None:
+                del values[Option.Image]
+
+        # name=~text, text=value -> ~~value
+        if name == Indicators.Text:
+            name = '~~' + (values.pop(Option.Text, None) or '')
+        elif name == Indicators.External:
+            name = values.pop(Option.Path, None) or ''
+
+        if not values:
+            return _escape_token(name)
+        return _escape_token(name) + ': ' + ', '.join(
+            _escape_token(k) + '=' + _escape_token(v) if v else _escape_token(k)
+            for k, v in sorted(values.items(), key=operator.itemgetter(0)))
 
     def _get_value_19(self):
         items = []
@@ -276,14 +290,14 @@ class IndicatorsEntry(BaseEntry):
             if row[Row.HasState] and not row[Row.State]:
                 continue
 
-            options = deepcopy(row[Row.Options].data)
-            name = options.pop(Option.Name)
+            options = row[Row.Options].data
+            name = options[Option.Name]
 
             # name=~text, text=value -> ~~value
             if name == Indicators.Text:
-                name = '~~' + (options.pop(Option.Text, None) or '')
+                name = '~~' + (options.get(Option.Text) or '')
             elif name == Indicators.External:
-                name = options.pop(Option.Path, None) or ''
+                name = options.get(Option.Path) or ''
 
             items.append(name)
         return ';'.join(items)
@@ -345,52 +359,75 @@ class IndicatorsEntry(BaseEntry):
         self._on_model_changed()
 
     def _read_options_string(self, s):
-        while s:
-            name, s = self._next_string_token(s, ':;')
+        pos, end = 0, len(s)
+        while pos < end:
+            name, pos = self._next_string_token(s, pos, _name_delimiters)
             options = {Option.Name: name}
 
-            if s.startswith(':'):
-                while s:
-                    option, s = self._next_string_token(s[1:], '=,;')
-                    if s.startswith('='):
-                        value, s = self._next_string_token(s[1:], ',;')
+            if pos < end and s[pos] == ':':
+                while pos + 1 < end:
+                    option, pos = self._next_string_token(s, pos + 1, _option_delimiters)
+                    if pos < end and s[pos] == '=':
+                        value, pos = self._next_string_token(s, pos + 1, _value_delimiters)
                     else:
                         value = None
                     options[option] = value
-                    if not s.startswith(','):
+                    if pos >= end or s[pos] != ',':
                         break
 
             yield options
-            s = s[1:]
+            pos += 1
 
-    def _next_string_token(self, s, delimiters):
-        token = []
-        quoted = False
+    def _next_string_token(self, s, pos, delimiters):
+        '''Returns (token, position of delimiter or of the last character)'''
+        end = len(s)
+        if pos >= end:
+            return None, end
 
-        for last, c in enumerate(s):
-            if not c.isspace():
-                break
+        last = _spaces_regex.match(s, pos).end()
+        if last == end:
+            last = end - 1
 
-        # Parsing quotes
-        for i, c in enumerate(s[last:], last):
-            if c == '"':
-                if i > last and s[i - 1] == '\\':
-                    token.append(s[last:i - 1])
-                    token.append('"')
-                else:
-                    token.append(s[last:i])
-                    quoted = not quoted
-                last = i + 1
-            elif not quoted and c in delimiters:
+        # Parsing quotes, parts of token are collected only for quoted strings
+        parts = None
+        quoted = False
+        i = last
+        while True:
+            if quoted:
+                i = s.find('"', i)
+            else:
+                match = delimiters.search(s, i)
+                i = match.start() if match else -1
+            if i < 0 or s[i] != '"':
+                break
+            if parts is None:
+                parts = []
+            if i > last and s[i - 1] == '\\':
+                parts.append(s[last:i - 1])
+                parts.append('"')
+            else:
+                parts.append(s[last:i])
+                quoted = not quoted
+            last = i = i + 1
+            if i == end:
+                i = -1
                 break
 
         if quoted:
-            return '', ''
-
-        if last != i or last == 0:
-            token.append(s[last: i if c in delimiters else i + 1].rstrip())
-
-        return ''.join(token) if token else None, s[i:]
+            return '', end
+
+        at_delimiter = i >= 0
+        if not at_delimiter:
+            i = end - 1
+
+        token = None
+        if last != i or last == pos:
+            token = s[last:i if at_delimiter else end].rstrip()
+        if parts is not None:
+            if token is not None:
+                parts.append(token)
+            token = ''.join(parts)
+        return token, i
 
     def _remove_selection(self):
         model, rowiter = self._selection.get_selected()
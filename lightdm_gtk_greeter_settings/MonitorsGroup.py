@@ -16,6 +16,8 @@
 #   with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from itertools import chain
+
 from lightdm_gtk_greeter_settings.MultiheadSetupDialog import MultiheadSetupDialog
 from lightdm_gtk_greeter_settings import (
     helpers,
@@ -104,11 +106,16 @@ class MonitorsGroup(OptionGroup.BaseGroup):
     def groups(self):
         return self._groups_wrapper
 
+    @property
+    def in_bulk_update(self):
+        return super().in_bulk_update or any(group.in_bulk_update for group in self._groups)
+
     def _add_group(self, monitor='', groupname='', config=None):
         group = OptionGroup.SimpleGroup(groupname, self._widgets)
 
         group.entry_added.connect(lambda g, s, e, k: self.entry_added.emit(s, e, k))
         group.entry_removed.connect(lambda g, s, e, k: self.entry_removed.emit(s, e, k))
+        group.entries_changed.connect(lambda g, entries: self.entries_changed.emit(entries))
 
         group.options = {key: (adapter.new_entry, None)
                          for key, adapter in self._adapters.items()}
@@ -123,6 +130,9 @@ class MonitorsGroup(OptionGroup.BaseGroup):
         self._groups.append(group)
         return group
 
+    def _get_entries(self):
+        return chain.from_iterable(group._get_entries() for group in self._groups)
+
     def _remove_group(self, group):
         group.clear()
         self._groups.remove(group)
@@ -17,6 +17,7 @@
 
 
 import time
+from contextlib import contextmanager
 from locale import gettext as _
 
 from gi.repository import (
@@ -46,6 +47,16 @@ __all__ = [
 
 class BaseEntry(GObject.GObject):
 
+    # Incremented on every change of entry state
+    __revision = 0
+    # (revision, value) of the last read of value property
+    __cached_value = None
+    # Names of "get"/"set" signals with connected handlers, emission is skipped for others
+    __connected_signals = frozenset()
+    # Nesting level of bulk_update() and "changed" signal postponed by it
+    __changes_frozen = 0
+    __changes_pending = False
+
     def __init__(self, widgets):
         super().__init__()
         self._widgets = widgets
@@ -62,16 +73,44 @@ class BaseEntry(GObject.GObject):
     @property
     def value(self):
         '''Option value'''
+        cached = self.__cached_value
+        if cached is not None and cached[0] == self.__revision:
+            return cached[1]
         value = self._get_value()
-        formatted = self.get.emit(value)
-        return value if formatted is None else formatted
+        if 'get' in self.__connected_signals:
+            formatted = self.get.emit(value)
+            if formatted is not None:
+                value = formatted
+        self.__cached_value = self.__revision, value
+        return value
 
     @value.setter
     def value(self, value):
-        if self.__use:
-            self.__use.set_active(True)
-        formatted = self.set.emit(value)
-        self._set_value(value if formatted is None else formatted)
+        with self.bulk_update():
+            if self.__use:
+                self.__use.set_active(True)
+            if 'set' in self.__connected_signals:
+                formatted = self.set.emit(value)
+                if formatted is not None:
+                    value = formatted
+            self._set_value(value)
+            self._invalidate_value()
+
+    @contextmanager
+    def bulk_update(self):
+        '''Postpones "changed" signal until the end of block.
+           Signal is emitted once if entry was changed inside of block.'''
+        self._freeze_changes()
+        try:
+            yield self
+        finally:
+            if self._thaw_changes():
+                self.changed.emit()
+
+    @property
+    def revision(self):
+        '''Modifications counter, value is not changed while revision is the same'''
+        return self.__revision
 
     @property
     def enabled(self):
@@ -109,6 +148,20 @@ class BaseEntry(GObject.GObject):
     def show_menu(self):
         pass
 
+    def connect(self, detailed_signal, handler, *args):
+        self.__on_connect(detailed_signal)
+        return super().connect(detailed_signal, handler, *args)
+
+    def connect_after(self, detailed_signal, handler, *args):
+        self.__on_connect(detailed_signal)
+        return super().connect_after(detailed_signal, handler, *args)
+
+    def __on_connect(self, detailed_signal):
+        name = detailed_signal.partition('::')[0]
+        if name in ('get', 'set'):
+            self.__connected_signals |= {name}
+            self._invalidate_value()
+
     def __repr__(self):
         try:
             value = self._get_value()
@@ -156,8 +209,26 @@ class BaseEntry(GObject.GObject):
     def _show_menu(self):
         self.__on_label_clicked()
 
+    def _invalidate_value(self):
+        self.__revision += 1
+
     def _emit_changed(self, *unused):
-        self.changed.emit()
+        self.__revision += 1
+        if self.__changes_frozen:
+            self.__changes_pending = True
+        else:
+            self.changed.emit()
+
+    def _freeze_changes(self):
+        self.__changes_frozen += 1
+
+    def _thaw_changes(self):
+        '''Returns True if postponed "changed" signal must be emitted now'''
+        self.__changes_frozen -= 1
+        if self.__changes_frozen or not self.__changes_pending:
+            return False
+        self.__changes_pending = False
+        return True
 
     def __on_use_toggled(self, toggle, *unused):
         self._set_enabled(self.__use.props.active)
@@ -16,15 +16,19 @@
 #   with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
+from contextlib import contextmanager
+
 from gi.repository import GObject
 
 from lightdm_gtk_greeter_settings.helpers import WidgetsWrapper
 from lightdm_gtk_greeter_settings.OptionEntry import BaseEntry
 from lightdm_gtk_greeter_settings import helpers
+from lightdm_gtk_greeter_settings import StartupProfiler
 
 
 __all__ = [
     'BaseGroup',
+    'LazyEntry',
     'OneToManyEntryAdapter',
     'SimpleGroup']
 
@@ -36,6 +40,7 @@ class BaseGroup(GObject.GObject):
         super().__init__()
         self.__entries_wrapper = helpers.SimpleDictWrapper(self._get_entry)
         self.__defaults_wrapper = helpers.SimpleDictWrapper(self._get_default)
+        self.__bulk_update_level = 0
 
     def read(self, config):
         '''Read group content from specified GreeterConfig object'''
@@ -49,6 +54,30 @@ class BaseGroup(GObject.GObject):
         '''Removes all entries'''
         raise NotImplementedError(self.__class__)
 
+    @contextmanager
+    def bulk_update(self):
+        '''Postpones "changed" signals of group entries until the end of block.
+           Every changed entry emits "changed" once, then "entries-changed" is emitted
+           with all of them.'''
+        entries = tuple(self._get_entries())
+        for entry in entries:
+            entry._freeze_changes()
+        self.__bulk_update_level += 1
+        try:
+            yield self
+        finally:
+            changed = [entry for entry in entries if entry._thaw_changes()]
+            for entry in changed:
+                entry.changed.emit()
+            self.__bulk_update_level -= 1
+            if changed:
+                self.entries_changed.emit(changed)
+
+    @property
+    def in_bulk_update(self):
+        '''True until "entries-changed" of current bulk_update() is emitted'''
+        return self.__bulk_update_level > 0
+
     @property
     def entries(self):
         '''entries["key"] - key => Entry mapping. Read only.'''
@@ -62,6 +91,9 @@ class BaseGroup(GObject.GObject):
     def _get_entry(self, key):
         raise NotImplementedError(self.__class__)
 
+    def _get_entries(self):
+        return ()
+
     def _get_default(self, key):
         raise NotImplementedError(self.__class__)
 
@@ -75,6 +107,11 @@ class BaseGroup(GObject.GObject):
         '''Entry has been removed from this group'''
         pass
 
+    @GObject.Signal('entries-changed')
+    def entries_changed(self, entries: object):
+        '''List of entries changed during bulk_update()'''
+        pass
+
 
 class SimpleGroup(BaseGroup):
 
@@ -103,7 +140,8 @@ class SimpleGroup(BaseGroup):
         self.clear()
 
         for key, (klass, default) in options.items():
-            entry = klass(WidgetsWrapper(self._widgets, key))
+            with StartupProfiler.phase('%s/%s entry' % (self._name, key)):
+                entry = klass(WidgetsWrapper(self._widgets, key))
             if default is not None:
                 entry.value = default
             self._entries[key] = entry
@@ -115,10 +153,11 @@ class SimpleGroup(BaseGroup):
             self.options = self._options_to_init
             self._options_to_init = None
 
-        for key, entry in self._entries.items():
-            value = config[self._name, key]
-            entry.value = value if value is not None else self._defaults[key]
-            entry.enabled = value is not None
+        with self.bulk_update():
+            for key, entry in self._entries.items():
+                value = config[self._name, key]
+                entry.value = value if value is not None else self._defaults[key]
+                entry.enabled = value is not None
 
     def write(self, config, is_changed=None):
         for key, entry in self._entries.items():
@@ -136,6 +175,9 @@ class SimpleGroup(BaseGroup):
     def _get_entry(self, key):
         return self._entries.get(key)
 
+    def _get_entries(self):
+        return self._entries.values()
+
     def _get_default(self, key):
         return self._defaults.get(key)
 
@@ -170,6 +212,7 @@ class OneToManyEntryAdapter:
             self._value = value
             if self._adapter._active == self and self._adapter._base_entry:
                 self._adapter._base_entry._set_value(value)
+                self._adapter._base_entry._invalidate_value()
 
         def _get_error(self):
             return self._error
@@ -228,6 +271,7 @@ class OneToManyEntryAdapter:
             self._base_entry._set_value(entry._value)
             self._base_entry._set_enabled(entry._enabled)
             self._base_entry._set_error(entry._error)
+            self._base_entry._invalidate_value()
 
     def _on_changed(self, entry):
         if self._active:
@@ -238,3 +282,83 @@ class OneToManyEntryAdapter:
     def _on_show_menu(self, base_entry):
         if self._active:
             self._active.show_menu.emit()
+
+
+class LazyEntry(BaseEntry):
+    '''Keeps state of entry which widgets are not created yet.
+       materialize() creates real entry of given class, all calls are redirected
+       to it after that.'''
+
+    def __init__(self, klass, widgets):
+        super().__init__(helpers.WidgetsWrapper(None))
+        self._klass = klass
+        self._widgets = widgets
+        self._entry = None
+        self._value = None
+        self._error = None
+        self._enabled = False
+
+    @property
+    def materialized(self):
+        return self._entry is not None
+
+    def materialize(self):
+        '''Creates real entry, its widgets must be available at this moment'''
+        if self._entry:
+            return self._entry
+
+        with StartupProfiler.phase('%s materialize' % self._klass.__name__):
+            entry = self._klass(self._widgets)
+        if self._value is not None:
+            entry._set_value(self._value)
+        entry._set_enabled(self._enabled)
+        entry._set_error(self._error)
+
+        self._entry = entry
+        entry.changed.connect(self._on_changed)
+        entry.show_menu.connect(self._on_show_menu)
+        self._invalidate_value()
+        return entry
+
+    def _get_value(self):
+        if self._entry:
+            return self._entry._get_value()
+        return self._value
+
+    def _set_value(self, value):
+        # Setting value enables entry, see BaseEntry.value
+        if self._entry:
+            self._entry._set_enabled(True)
+            self._entry._set_value(value)
+        else:
+            self._value = value
+            self._enabled = True
+
+    def _get_error(self):
+        if self._entry:
+            return self._entry._get_error()
+        return self._error
+
+    def _set_error(self, text):
+        if self._entry:
+            self._entry._set_error(text)
+        else:
+            self._error = text
+
+    def _get_enabled(self):
+        if self._entry:
+            return self._entry._get_enabled()
+        return self._enabled
+
+    def _set_enabled(self, value):
+        if self._entry:
+            self._entry._set_enabled(value)
+        else:
+            self._enabled = value
+            self._emit_changed()
+
+    def _on_changed(self, entry):
+        self._emit_changed()
+
+    def _on_show_menu(self, entry):
+        self.show_menu.emit()
@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2014 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+# Startup phases timings, enabled by "--profile-startup[=FILE]" argument or by
+# LIGHTDM_GTK_GREETER_SETTINGS_PROFILE=[FILE] environment variable.
+# Timings are collected until the first "map-event" of main window, then
+# summary is printed to stderr. FILE can be used to save more details:
+#   *.json              - trace in Chrome trace event format (chrome://tracing, Perfetto)
+#   *.prof, *.pstats    - cProfile statistics (python3 -m pstats FILE)
+# This module must not import gi: "import gi" is one of measured phases.
+
+import cProfile
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+
+__all__ = ['finish', 'finish_on_map', 'get_output', 'phase', 'start', 'timed']
+
+
+EnvironmentVariable = 'LIGHTDM_GTK_GREETER_SETTINGS_PROFILE'
+Argument = '--profile-startup'
+
+# Active StartupProfiler or None
+_profiler = None
+
+
+class StartupProfiler:
+
+    def __init__(self, output=None):
+        self._output = output or None
+        self._started = time.monotonic()
+        self._finished = None
+        # [name, start, end, thread]
+        self._phases = []
+        self._active = set()
+        self._cprofile = None
+        if self._output and self._output.endswith(('.prof', '.pstats')):
+            self._cprofile = cProfile.Profile()
+            self._cprofile.enable()
+
+    @contextmanager
+    def phase(self, name):
+        # Nested phases with the same name (recursive calls) are not recorded
+        key = name, threading.get_ident()
+        if self._finished is not None or key in self._active:
+            yield
+            return
+        record = [name, time.monotonic(), None, key[1]]
+        self._phases.append(record)
+        self._active.add(key)
+        try:
+            yield
+        finally:
+            self._active.discard(key)
+            record[2] = time.monotonic()
+
+    def finish(self):
+        if self._finished is not None:
+            return
+        self._finished = time.monotonic()
+        if self._cprofile:
+            self._cprofile.disable()
+
+        print(self.format_summary(), file=sys.stderr)
+
+        if not self._output:
+            return
+        try:
+            if self._cprofile:
+                self._cprofile.dump_stats(self._output)
+            elif self._output.endswith('.json'):
+                with open(self._output, 'w') as file:
+                    json.dump(self.get_trace(), file, indent=1)
+            else:
+                with open(self._output, 'w') as file:
+                    file.write(self.format_summary() + '\n')
+        except OSError as e:
+            print('Failed to save startup profile: %s' % e, file=sys.stderr)
+
+    def format_summary(self):
+        '''Phases in order of first start: count, total time and offset of first start'''
+        totals = {}
+        for name, start, end, __ in self._phases:
+            if end is None:
+                end = self._finished
+            count, total, first = totals.get(name, (0, 0.0, start))
+            totals[name] = count + 1, total + end - start, first
+
+        lines = ['Startup profile (ms):',
+                 '  %9s %9s %6s  %s' % ('offset', 'total', 'count', 'phase')]
+        for name, (count, total, first) in sorted(totals.items(), key=lambda t: t[1][2]):
+            offset = (first - self._started) * 1000
+            lines.append('  %9.1f %9.1f %6d  %s' % (offset, total * 1000, count, name))
+        lines.append('  %9.1f %9s %6s  %s' % ((self._finished - self._started) * 1000,
+                                              '', '', 'map-event'))
+        return '\n'.join(lines)
+
+    def get_trace(self):
+        '''Phases as complete ("X") events of Chrome trace event format'''
+        pid = os.getpid()
+        events = [{'name': name, 'ph': 'X', 'pid': pid, 'tid': thread,
+                   'ts': round((start - self._started) * 1e6, 1),
+                   'dur': round(((end or self._finished) - start) * 1e6, 1)}
+                  for name, start, end, thread in self._phases]
+        events.append({'name': 'map-event', 'ph': 'i', 's': 'g', 'pid': pid,
+                       'tid': threading.get_ident(),
+                       'ts': round((self._finished - self._started) * 1e6, 1)})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+
+def get_output(argv=None):
+    '''Returns None if profiling is not requested, output file name or "" otherwise.
+       Arguments are checked before argparse to measure imports.'''
+    argv = sys.argv[1:] if argv is None else argv
+    for i, arg in enumerate(argv):
+        if arg == Argument:
+            following = argv[i + 1] if i + 1 < len(argv) else ''
+            return following if not following.startswith('-') else ''
+        if arg.startswith(Argument + '='):
+            return arg[len(Argument) + 1:]
+    return os.getenv(EnvironmentVariable)
+
+
+def start(output=None):
+    global _profiler
+    if _profiler is None:
+        _profiler = StartupProfiler(output)
+    return _profiler
+
+
+def finish():
+    if _profiler:
+        _profiler.finish()
+
+
+def finish_on_map(widget):
+    '''Finishes profiling on the first "map-event" of given widget'''
+    if not _profiler:
+        return
+
+    def on_map_event(widget, event):
+        widget.disconnect(handler_id)
+        finish()
+        return False
+
+    handler_id = widget.connect('map-event', on_map_event)
+
+
+class _NoPhase:
+
+    def __enter__(self):
+        return None
+
+    def __exit__(self, *args):
+        return False
+
+
+_no_phase = _NoPhase()
+
+
+def phase(name):
+    '''Context manager to measure block as phase with given name'''
+    if _profiler is None:
+        return _no_phase
+    return _profiler.phase(name)
+
+
+def timed(name):
+    '''Decorator: every call of function is measured as phase with given name'''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if _profiler is None:
+                return f(*args, **kwargs)
+            with _profiler.phase(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
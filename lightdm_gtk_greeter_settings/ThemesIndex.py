@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+# -*- Mode: Python; coding: utf-8; indent-tabs-mode: nil; tab-width: 4 -*-
+#   LightDM GTK Greeter Settings
+#   Copyright (C) 2015 Andrew P. <pan.pav.7c5@gmail.com>
+#
+#   This program is free software: you can redistribute it and/or modify it
+#   under the terms of the GNU General Public License version 3, as published
+#   by the Free Software Foundation.
+#
+#   This program is distributed in the hope that it will be useful, but
+#   WITHOUT ANY WARRANTY; without even the implied warranties of
+#   MERCHANTABILITY, SATISFACTORY QUALITY, or FITNESS FOR A PARTICULAR
+#   PURPOSE.  See the GNU General Public License for more details.
+#
+#   You should have received a copy of the GNU General Public License along
+#   with this program.  If not, see <http://www.gnu.org/licenses/>.
+
+
+import json
+import os
+import sys
+import threading
+from glob import iglob
+
+from gi.repository import GLib
+
+from lightdm_gtk_greeter_settings import StartupProfiler
+from lightdm_gtk_greeter_settings.helpers import get_cache_path
+
+
+__all__ = ['ThemesIndex']
+
+
+class ThemesIndex:
+    '''Names of themes found in all data directories.
+       Directories are scanned in worker thread, results are cached between launches
+       and reused while modification time of directory is not changed.'''
+
+    CacheFile = 'themes.json'
+
+    def __init__(self, name, subdir, pattern):
+        # Name of cache section
+        self._name = name
+        # Directory name inside of data directories: "themes", "icons"
+        self._subdir = subdir
+        # Path of file (glob pattern) which must exist inside of theme directory
+        self._pattern = pattern
+        self._directories = None
+        # directory => set of themes
+        self._found = {}
+        # directory => (mtime, sorted themes)
+        self._scanned = {}
+        self._pending = 0
+
+    @property
+    def directories(self):
+        '''Directories to search themes in, ordered by priority'''
+        if self._directories is None:
+            directories = [os.path.join(GLib.get_user_data_dir(), self._subdir),
+                           os.path.join(GLib.get_home_dir(), '.' + self._subdir)]
+            directories += (os.path.join(path, self._subdir)
+                            for path in GLib.get_system_data_dirs())
+            directories.append(os.path.join(sys.prefix, 'share', self._subdir))
+            self._directories = []
+            for path in map(os.path.normpath, directories):
+                if path not in self._directories:
+                    self._directories.append(path)
+        return self._directories
+
+    @StartupProfiler.timed('ThemesIndex.load')
+    def load(self, callback):
+        '''Calls callback(names) in main loop for every portion of found themes'''
+        cache = self._read_cache().get(self._name, {})
+        to_scan = []
+        for path in self.directories:
+            try:
+                mtime = os.stat(path).st_mtime_ns
+            except OSError:
+                continue
+            cached = cache.get(path)
+            if cached and cached[0] == mtime:
+                self._found[path] = set(cached[1])
+                self._scanned[path] = cached
+                callback(cached[1])
+            else:
+                to_scan.append((path, mtime))
+
+        if to_scan:
+            self._pending += len(to_scan)
+            thread = threading.Thread(target=self._scan, args=(to_scan, callback), daemon=True)
+            thread.start()
+
+    def get_path(self, name):
+        '''Returns path of theme file (pattern) in the first directory with this theme'''
+        location = next((path for path in self.directories if name in self._found.get(path, ())),
+                        os.path.join(sys.prefix, 'share', self._subdir))
+        return os.path.join(location, name, *self._pattern)
+
+    @StartupProfiler.timed('ThemesIndex._scan (thread)')
+    def _scan(self, directories, callback):
+        for path, mtime in directories:
+            try:
+                names = os.listdir(path)
+            except OSError:
+                names = ()
+            themes = sorted(name for name in names
+                            if next(iglob(os.path.join(path, name, *self._pattern)), None))
+            GLib.idle_add(self._on_directory_scanned, path, mtime, themes, callback)
+
+    def _on_directory_scanned(self, path, mtime, themes, callback):
+        self._found[path] = set(themes)
+        self._scanned[path] = [mtime, themes]
+        self._pending -= 1
+        if themes:
+            callback(themes)
+        if not self._pending:
+            self._write_cache()
+        return False
+
+    def _read_cache(self):
+        try:
+            with open(get_cache_path(self.CacheFile)) as file:
+                cache = json.load(file)
+        except (OSError, ValueError):
+            return {}
+        return cache if isinstance(cache, dict) else {}
+
+    def _write_cache(self):
+        cache = self._read_cache()
+        cache[self._name] = self._scanned
+        path = get_cache_path(self.CacheFile)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path + '.tmp', 'w') as file:
+                json.dump(cache, file)
+            os.replace(path + '.tmp', path)
+        except OSError:
+            pass
@@ -20,21 +20,40 @@ def main():
     import argparse
     import locale
     import os
+    import sys
+
+    from lightdm_gtk_greeter_settings import StartupProfiler
 
-    from gi.repository import Gtk
-    from lightdm_gtk_greeter_settings import helpers
-    from lightdm_gtk_greeter_settings import GtkGreeterSettingsWindow
-    from lightdm_gtk_greeter_settings.GtkGreeterSettingsWindow import WindowMode
+    profile_output = StartupProfiler.get_output()
+    if profile_output is not None:
+        StartupProfiler.start(profile_output)
 
     locale.textdomain('lightdm-gtk-greeter-settings')
 
+    # GreeterDefaults translates default values on import, after textdomain()
+    from lightdm_gtk_greeter_settings import CommandLine
+
     parser = argparse.ArgumentParser(description='LightDM GTK Greeter settings editor')
     parser.add_argument('-s', '--socket-id', action='store', help='Settings manager socket')
     parser.add_argument('--use-gtk-header', action='store_const', const=True,
                         help='Use GtkHeaderBar')
     parser.add_argument('--test-socket', action='store_const', const=True)
+    parser.add_argument(StartupProfiler.Argument, nargs='?', const='', metavar='FILE',
+                        help='Print startup phases timings, save cProfile (*.prof) '
+                             'or trace (*.json) to FILE')
+    CommandLine.add_arguments(parser)
     args = parser.parse_args()
 
+    if CommandLine.is_requested(args):
+        sys.exit(CommandLine.run(args))
+
+    with StartupProfiler.phase('import gi'):
+        from gi.repository import Gtk
+    with StartupProfiler.phase('import modules'):
+        from lightdm_gtk_greeter_settings import helpers
+        from lightdm_gtk_greeter_settings import GtkGreeterSettingsWindow
+        from lightdm_gtk_greeter_settings.GtkGreeterSettingsWindow import WindowMode
+
     if args.test_socket:
         w = Gtk.Window()
         w.props.title = 'Testing embedded mode'
@@ -52,10 +71,12 @@ def main():
         window = GtkGreeterSettingsWindow.GtkGreeterSettingsWindow(WindowMode.Embedded)
         plug = Gtk.Plug.new(socket_id)
         plug.connect('delete-event', Gtk.main_quit)
+        StartupProfiler.finish_on_map(plug)
         plug.show()
         content = window.builder.get_object('content_box')
         content.reparent(plug)
         Gtk.main()
+        window.flush()
     else:
         if args.use_gtk_header is None:
             args.use_gtk_header = helpers.string2bool(os.getenv('GTK_CSD'), False)
@@ -67,6 +88,7 @@ def main():
             window_mode = WindowMode.GtkHeader
 
         window = GtkGreeterSettingsWindow.GtkGreeterSettingsWindow(mode=window_mode)
+        StartupProfiler.finish_on_map(window)
         window.show()
         Gtk.main()
 
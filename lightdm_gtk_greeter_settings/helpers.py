@@ -18,10 +18,12 @@
 
 import configparser
 import glob
+import hashlib
 import locale
 import os
 import pwd
 import stat
+import threading
 
 from collections import (
     namedtuple,
@@ -32,12 +34,14 @@ from itertools import (
     accumulate)
 from locale import gettext as _
 
+# Gtk, GdkPixbuf and Pango are imported by functions using them:
+# command line mode uses this module without display
 from gi.repository import (
-    GdkPixbuf,
+    Gio,
     GLib,
-    GObject,
-    Gtk,
-    Pango)
+    GObject)
+
+from lightdm_gtk_greeter_settings import StartupProfiler
 
 
 __license__ = 'GPL-3'
@@ -62,11 +66,13 @@ __all__ = [
     'check_path_accessibility',
     'DefaultValueDict',
     'file_is_readable_by_greeter',
+    'get_cache_path',
     'get_config_path',
     'get_data_path',
     'get_greeter_version'
     'get_markup_error',
     'get_version',
+    'ImagePreviewLoader',
     'ModelRowEnum',
     'NC_',
     'pixbuf_from_file_scaled_down',
@@ -77,7 +83,8 @@ __all__ = [
     'string2bool',
     'TreeStoreDataWrapper',
     'WidgetsEnum',
-    'WidgetsWrapper']
+    'WidgetsWrapper',
+    'WriteScheduler']
 
 
 def C_(context, message):
@@ -102,6 +109,10 @@ def get_config_path():
     return os.path.abspath(__config_path__)
 
 
+def get_cache_path(*parts):
+    return os.path.join(GLib.get_user_cache_dir(), 'lightdm-gtk-greeter-settings', *parts)
+
+
 def get_version():
     return __version__
 
@@ -134,32 +145,125 @@ def string2bool(value, fallback=False):
 
 
 def show_message(**kwargs):
+    from gi.repository import Gtk
     dialog = Gtk.MessageDialog(parent=Gtk.Window.list_toplevels()[0],
                                buttons=Gtk.ButtonsType.CLOSE, **kwargs)
     dialog.run()
     dialog.destroy()
 
 
+# (path, st_mtime_ns, st_size, width, height) => GdkPixbuf.Pixbuf
+_pixbufs_cache = OrderedDict()
+_pixbufs_cache_size = 32
+_pixbufs_cache_lock = threading.Lock()
+
+# http://specifications.freedesktop.org/thumbnail-spec/thumbnail-spec-latest.html
+ThumbnailSizes = (('normal', 128), ('large', 256))
+
+
 def pixbuf_from_file_scaled_down(path, width, height):
-    pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
-    scale = max(pixbuf.props.width / width, pixbuf.props.height / height)
+    from gi.repository import GdkPixbuf
+    st = os.stat(path)
+    key = path, st.st_mtime_ns, st.st_size, width, height
+    pixbuf = _get_cached_pixbuf(key)
+    if pixbuf is not None:
+        return pixbuf
+
+    thumbnail_path, thumbnail_size = _get_thumbnail_path(path, max(width, height))
+    pixbuf = thumbnail_path and _load_thumbnail(thumbnail_path, path, st)
+    if pixbuf is None:
+        __, image_width, image_height = GdkPixbuf.Pixbuf.get_file_info(path)
+        if thumbnail_path and max(image_width, image_height) > thumbnail_size:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, thumbnail_size,
+                                                             thumbnail_size, True)
+            _save_thumbnail(thumbnail_path, pixbuf, path, st)
+        elif image_width > width or image_height > height:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_scale(path, width, height, True)
+        else:
+            pixbuf = GdkPixbuf.Pixbuf.new_from_file(path)
 
+    scale = max(pixbuf.props.width / width, pixbuf.props.height / height)
     if scale > 1:
-        return GdkPixbuf.Pixbuf.scale_simple(pixbuf,
-                                             pixbuf.props.width / scale,
-                                             pixbuf.props.height / scale,
-                                             GdkPixbuf.InterpType.BILINEAR)
+        pixbuf = GdkPixbuf.Pixbuf.scale_simple(pixbuf,
+                                               max(1, pixbuf.props.width / scale),
+                                               max(1, pixbuf.props.height / scale),
+                                               GdkPixbuf.InterpType.BILINEAR)
+
+    with _pixbufs_cache_lock:
+        _pixbufs_cache[key] = pixbuf
+        if len(_pixbufs_cache) > _pixbufs_cache_size:
+            _pixbufs_cache.popitem(last=False)
+    return pixbuf
+
+
+def _get_cached_pixbuf(key):
+    with _pixbufs_cache_lock:
+        pixbuf = _pixbufs_cache.get(key)
+        if pixbuf is not None:
+            _pixbufs_cache.move_to_end(key)
+        return pixbuf
+
+
+def _get_thumbnail_path(path, size):
+    '''Returns (path, size) of shared thumbnail suitable for given size or (None, None)'''
+    root = os.path.join(GLib.get_user_cache_dir(), 'thumbnails')
+    if path.startswith(os.path.join(root, '')):
+        return None, None
+    for directory, thumbnail_size in ThumbnailSizes:
+        if size <= thumbnail_size:
+            uri = GLib.filename_to_uri(os.path.abspath(path))
+            name = hashlib.md5(uri.encode()).hexdigest() + '.png'
+            return os.path.join(root, directory, name), thumbnail_size
+    return None, None
+
+
+def _load_thumbnail(thumbnail_path, path, st):
+    from gi.repository import GdkPixbuf
+    try:
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file(thumbnail_path)
+    except GLib.Error:
+        return None
+    uri = GLib.filename_to_uri(os.path.abspath(path))
+    if pixbuf.get_option('tEXt::Thumb::URI') != uri or \
+       pixbuf.get_option('tEXt::Thumb::MTime') != str(int(st.st_mtime)):
+        return None
     return pixbuf
 
 
+def _save_thumbnail(thumbnail_path, pixbuf, path, st):
+    options = (('tEXt::Thumb::URI', GLib.filename_to_uri(os.path.abspath(path))),
+               ('tEXt::Thumb::MTime', str(int(st.st_mtime))),
+               ('tEXt::Thumb::Size', str(st.st_size)),
+               ('tEXt::Software', 'lightdm-gtk-greeter-settings'))
+    directory = os.path.dirname(thumbnail_path)
+    # Thumbnails are saved by worker threads, name must be unique per thread
+    temp_path = '%s.%d.%d.tmp' % (thumbnail_path, os.getpid(), threading.get_ident())
+    try:
+        os.makedirs(os.path.dirname(directory), mode=0o700, exist_ok=True)
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+        pixbuf.savev(temp_path, 'png', [k for k, v in options], [v for k, v in options])
+        os.chmod(temp_path, 0o600)
+        os.replace(temp_path, thumbnail_path)
+    except (OSError, GLib.Error):
+        try:
+            os.unlink(temp_path)
+        except OSError:
+            pass
+
+
+def _get_image_preview_size(image):
+    width, height = image.get_size_request()
+    if -1 in (width, height):
+        width, height = 64, 64
+    return width, height
+
+
 def set_image_from_path(image, path):
     if not path or not os.path.isfile(path):
         image.props.icon_name = 'unknown'
     else:
         try:
-            width, height = image.get_size_request()
-            if -1 in (width, height):
-                width, height = 64, 64
+            width, height = _get_image_preview_size(image)
             pixbuf = pixbuf_from_file_scaled_down(path, width, height)
             image.set_from_pixbuf(pixbuf)
             return True
@@ -168,15 +272,83 @@ def set_image_from_path(image, path):
     return False
 
 
+class ImagePreviewLoader:
+    '''Asynchronous version of set_image_from_path() for frequently changed previews.
+       Images are decoded in worker thread, pending request is replaced by newer one
+       and only result of the latest request is shown.'''
+
+    def __init__(self, image):
+        self._image = image
+        self._serial = 0
+        self._request = None
+        self._condition = threading.Condition()
+        self._thread = None
+
+    def load(self, path):
+        self._serial += 1
+        with self._condition:
+            self._request = None
+
+        if not path or not os.path.isfile(path):
+            self._image.props.icon_name = 'unknown'
+            return
+
+        width, height = _get_image_preview_size(self._image)
+        try:
+            st = os.stat(path)
+        except OSError:
+            self._image.props.icon_name = 'file-broken'
+            return
+
+        pixbuf = _get_cached_pixbuf((path, st.st_mtime_ns, st.st_size, width, height))
+        if pixbuf is not None:
+            self._image.set_from_pixbuf(pixbuf)
+            return
+
+        self._image.props.icon_name = 'image-loading'
+        with self._condition:
+            self._request = self._serial, path, width, height
+            self._condition.notify()
+        if not self._thread:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def cancel(self):
+        self._serial += 1
+        with self._condition:
+            self._request = None
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while not self._request:
+                    self._condition.wait()
+                serial, path, width, height = self._request
+                self._request = None
+            try:
+                pixbuf = pixbuf_from_file_scaled_down(path, width, height)
+            except (GLib.Error, OSError):
+                pixbuf = None
+            GLib.idle_add(self._on_loaded, serial, pixbuf)
+
+    def _on_loaded(self, serial, pixbuf):
+        if serial == self._serial:
+            if pixbuf:
+                self._image.set_from_pixbuf(pixbuf)
+            else:
+                self._image.props.icon_name = 'file-broken'
+        return False
+
+
+@StartupProfiler.timed('check_path_accessibility')
 def check_path_accessibility(path, file=True, executable=False):
     """Return None  if file is readable by greeter and error message otherwise"""
 
     # LP: #1709864, Support gtk-3.* themes
     if "gtk-3.*" in path:
-        for x in range(0, 40):
-            if os.path.exists(path.replace("gtk-3.*", "gtk-3.%i" % x)):
-                path = path.replace("gtk-3.*", "gtk-3.%i" % x)
-                return check_path_accessibility(path, file, executable)
+        resolved = _resolve_gtk3_path(path)
+        if resolved:
+            return check_path_accessibility(resolved, file, executable)
 
     if not os.path.exists(path):
         return _('File not found: {path}').format(path=path)
@@ -199,24 +371,7 @@ def check_path_accessibility(path, file=True, executable=False):
     if not parts[0]:
         parts[0] = os.path.sep
 
-    def check(p):
-        try:
-            st = os.stat(p)
-        except OSError as e:
-            return _('Failed to check permissions: {error}'.format(error=e.strerror))
-
-        if stat.S_ISDIR(st.st_mode) and not stat.S_IREAD:
-            return _('Directory is not readable: {path}'.format(path=p))
-        if st.st_uid == uid:
-            return not (st.st_mode & stat.S_IRUSR) and \
-                _('LightDM does not have permissions to read path: {path}'.format(path=p))
-        if st.st_gid in gids:
-            return not (st.st_mode & stat.S_IRGRP) and \
-                _('LightDM does not have permissions to read path: {path}'.format(path=p))
-        return not (st.st_mode & stat.S_IROTH) and \
-            _('LightDM does not have permissions to read path: {path}'.format(path=p))
-
-    errors = (check(p) for p in accumulate(parts, os.path.join))
+    errors = (_check_path_permissions(p, uid, gids) for p in accumulate(parts, os.path.join))
     error = next((error for error in errors if error), None)
 
     if not error and file and not os.path.isfile(path):
@@ -238,7 +393,103 @@ def check_path_accessibility(path, file=True, executable=False):
     return error
 
 
+# path => error, valid while parent directory is monitored
+_path_permissions_cache = {}
+# "theme/gtk-3.*/file" => ("theme/", "theme/gtk-3.N/file" or None)
+_gtk3_paths_cache = {}
+# directory path => Gio.FileMonitor or None
+_directory_monitors = {}
+
+
+def _resolve_gtk3_path(path):
+    '''Returns path with "gtk-3.*" replaced by existing gtk-3.N directory with lowest N'''
+    try:
+        return _gtk3_paths_cache[path][1]
+    except KeyError:
+        pass
+
+    root, __, suffix = path.partition('gtk-3.*')
+    try:
+        names = os.listdir(root or os.curdir)
+    except OSError:
+        return None
+
+    versions = sorted((int(name[6:]), name) for name in names
+                      if name.startswith('gtk-3.') and name[6:].isdigit())
+    resolved = None
+    watched = _watch_directory(os.path.normpath(root or os.curdir))
+    for __, name in versions:
+        watched = _watch_directory(os.path.join(root, name)) and watched
+        if os.path.exists(root + name + suffix):
+            resolved = root + name + suffix
+            break
+
+    if watched:
+        _gtk3_paths_cache[path] = root, resolved
+    return resolved
+
+
+def _check_path_permissions(path, uid, gids):
+    try:
+        return _path_permissions_cache[path]
+    except KeyError:
+        pass
+
+    try:
+        st = os.stat(path)
+    except OSError as e:
+        return _('Failed to check permissions: {error}'.format(error=e.strerror))
+
+    if stat.S_ISDIR(st.st_mode) and not stat.S_IREAD:
+        error = _('Directory is not readable: {path}'.format(path=path))
+    elif st.st_uid == uid:
+        error = not (st.st_mode & stat.S_IRUSR) and \
+            _('LightDM does not have permissions to read path: {path}'.format(path=path))
+    elif st.st_gid in gids:
+        error = not (st.st_mode & stat.S_IRGRP) and \
+            _('LightDM does not have permissions to read path: {path}'.format(path=path))
+    else:
+        error = not (st.st_mode & stat.S_IROTH) and \
+            _('LightDM does not have permissions to read path: {path}'.format(path=path))
+
+    # Changes of path (permissions, owner, removing) are reported by parent directory monitor
+    if _watch_directory(os.path.dirname(path)):
+        _path_permissions_cache[path] = error
+    return error
+
+
+def _watch_directory(path):
+    '''Returns True if changes in directory are monitored'''
+    try:
+        return _directory_monitors[path] is not None
+    except KeyError:
+        pass
+
+    try:
+        monitor = Gio.File.new_for_path(path).monitor_directory(Gio.FileMonitorFlags.NONE, None)
+        monitor.connect('changed', _on_watched_directory_changed)
+    except GLib.Error:
+        monitor = None
+    _directory_monitors[path] = monitor
+    return monitor is not None
+
+
+def _on_watched_directory_changed(monitor, file, other_file, event_type):
+    for changed in (file, other_file):
+        path = changed.get_path() if changed else None
+        if not path:
+            continue
+        prefix = os.path.join(path, '')
+        for key in [key for key in _path_permissions_cache
+                    if key == path or key.startswith(prefix)]:
+            del _path_permissions_cache[key]
+        for key in [key for key, (root, __) in _gtk3_paths_cache.items()
+                    if root.startswith(prefix) or path.startswith(root)]:
+            del _gtk3_paths_cache[key]
+
+
 def get_markup_error(markup):
+    from gi.repository import Pango
     try:
         Pango.parse_markup(markup, -1, '\0')
     except GLib.Error as e:
@@ -340,14 +591,15 @@ class WidgetsWrapper:
     def __init__(self, source, *prefixes):
         if source is None:
             return
-        if isinstance(source, Gtk.Builder):
-            self._builder = source
-            self._prefixes = tuple(prefixes)
-        elif isinstance(source, WidgetsWrapper):
+        if isinstance(source, WidgetsWrapper):
             self._builder = source._builder
             self._prefixes = source._prefixes + tuple(prefixes)
         else:
-            raise TypeError(source)
+            from gi.repository import Gtk
+            if not isinstance(source, Gtk.Builder):
+                raise TypeError(source)
+            self._builder = source
+            self._prefixes = tuple(prefixes)
 
     def __getitem__(self, args):
         if not self._builder:
@@ -391,3 +643,59 @@ class SimpleDictWrapper:
 
     def add(self, value):
         return self._add(value)
+
+
+class WriteScheduler:
+    '''Coalesces bursts of schedule() calls into a single callback() call.
+       Delay is doubled (up to max_delay) while requests keep coming, but
+       callback() is never postponed for more than max_latency ms after the
+       first pending request.'''
+
+    def __init__(self, callback, delay=250, max_delay=1000, max_latency=2000):
+        self._callback = callback
+        self._min_delay = delay
+        self._max_delay = max_delay
+        self._max_latency = max_latency
+        self._delay = delay
+        self._timeout_id = None
+        self._first_request = None
+        self._last_request = None
+        # Statistics
+        self.writes_issued = 0
+        self.writes_coalesced = 0
+
+    @property
+    def pending(self):
+        return self._timeout_id is not None
+
+    def schedule(self):
+        now = GLib.get_monotonic_time() // 1000
+        if self._timeout_id:
+            GLib.Source.remove(self._timeout_id)
+            self.writes_coalesced += 1
+            if now - self._last_request < self._delay:
+                self._delay = min(self._delay * 2, self._max_delay)
+        else:
+            self._first_request = now
+            self._delay = self._min_delay
+        self._last_request = now
+
+        delay = min(self._delay, max(0, self._first_request + self._max_latency - now))
+        self._timeout_id = GLib.timeout_add(delay, self._on_timeout)
+
+    def flush(self):
+        '''Calls pending callback immediately'''
+        if self._timeout_id:
+            GLib.Source.remove(self._timeout_id)
+            self._on_timeout()
+
+    def cancel(self):
+        if self._timeout_id:
+            GLib.Source.remove(self._timeout_id)
+            self._timeout_id = None
+
+    def _on_timeout(self):
+        self._timeout_id = None
+        self.writes_issued += 1
+        self._callback()
+        return False